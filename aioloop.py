@@ -0,0 +1,388 @@
+import asyncio
+import heapq
+import os
+import threading
+from asyncio import events
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from time import monotonic
+
+from pywayland.server.eventloop import EventLoop
+
+
+class WaylandEventLoop(asyncio.AbstractEventLoop):
+	"""
+	Asyncio event loop running on top of the wlroots (`wl_event_loop`) main loop, so coroutines interleave with
+	compositor events and never block the frame path.
+	The display is still run by `Display.run()`; use `run_display()` to make this loop current meanwhile.
+	Without a display, `run_forever()` and `run_until_complete()` dispatch the Wayland event loop directly.
+	
+	Event sources are persistent: pywayland keeps the callback of every source it ever created, even after `remove()`,
+	so a source per callback would leak. Ready callbacks run from the wakeup pipe, timers share one timer source re-armed
+	for the earliest deadline, and every registered reader or writer has one fd source until it is removed.
+	"""
+	
+	def __init__(self, event_loop):
+		self.__event_loop = event_loop
+		self.__ready = deque()
+		self.__ready_pending = False # a wakeup is in the pipe for the ready queue
+		self.__display = None
+		self.__stopping = False
+		self.__scheduled = [] # heap of timer handles
+		self.__cancelled_timers = 0
+		self.__readers = {}
+		self.__writers = {}
+		self.__signals = {}
+		self.__running = False
+		self.__closed = False
+		self.__debug = False
+		self.__executor = None
+		self.__exception_handler = None
+		self.__task_factory = None
+		
+		self.__lock = threading.Lock()
+		self.__threadsafe = deque()
+		self.__wakeup_read, self.__wakeup_write = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+		self.__wakeup = event_loop.add_fd(self.__wakeup_read, self.__wakeup_callback)
+		self.__timer = event_loop.add_timer(self.__timer_callback)
+	
+	def run_display(self, display):
+		"Run the Wayland display with this loop set as the running asyncio loop."
+		
+		self.__running = True
+		self.__display = display
+		events._set_running_loop(self)
+		try:
+			display.run()
+		finally:
+			events._set_running_loop(None)
+			self.__display = None
+			self.__running = False
+	
+	def run_forever(self):
+		"Dispatch the Wayland event loop until `stop()`. Clients are not flushed; a compositor should use `run_display()`."
+		
+		if self.__running:
+			raise RuntimeError("This event loop is already running")
+		
+		self.__stopping = False
+		self.__running = True
+		events._set_running_loop(self)
+		try:
+			while not self.__stopping:
+				self.__event_loop.dispatch(-1)
+		finally:
+			events._set_running_loop(None)
+			self.__running = False
+	
+	def run_until_complete(self, future):
+		future = asyncio.ensure_future(future, loop=self)
+		future.add_done_callback(lambda _future: self.stop())
+		self.run_forever()
+		if not future.done():
+			raise RuntimeError("Event loop stopped before Future completed.")
+		return future.result()
+	
+	def stop(self):
+		"Stop `run_forever()` after the current iteration, or terminate the display run by `run_display()`."
+		
+		if self.__display is not None:
+			self.__display.terminate()
+		else:
+			self.__stopping = True
+			self.__wake() # wake up the dispatch
+	
+	# scheduling
+	
+	def time(self):
+		return monotonic()
+	
+	def call_soon(self, callback, *args, context=None):
+		handle = asyncio.Handle(callback, args, self, context)
+		self.__ready.append(handle)
+		if not self.__ready_pending:
+			self.__ready_pending = True
+			self.__wake()
+		return handle
+	
+	def call_soon_threadsafe(self, callback, *args, context=None):
+		handle = asyncio.Handle(callback, args, self, context)
+		with self.__lock:
+			self.__threadsafe.append(handle)
+		self.__wake()
+		return handle
+	
+	def __wake(self):
+		try:
+			os.write(self.__wakeup_write, b'\0')
+		except BlockingIOError:
+			pass # pipe full, the wakeup is pending anyway
+	
+	def call_later(self, delay, callback, *args, context=None):
+		return self.call_at(self.time() + delay, callback, *args, context=context)
+	
+	def call_at(self, when, callback, *args, context=None):
+		handle = asyncio.TimerHandle(when, callback, args, self, context)
+		handle._scheduled = True # reported to `_timer_handle_cancelled`
+		heapq.heappush(self.__scheduled, handle)
+		if self.__scheduled[0] is handle:
+			self.__timer_arm()
+		return handle
+	
+	def _timer_handle_cancelled(self, handle):
+		"Cancelled handles stay in the heap until due; the heap is compacted when they are the majority."
+		
+		if not handle._scheduled:
+			return
+		self.__cancelled_timers += 1
+		if self.__cancelled_timers > 64 and self.__cancelled_timers * 2 > len(self.__scheduled):
+			for _handle in self.__scheduled:
+				if _handle.cancelled() or _handle is handle:
+					_handle._scheduled = False
+			self.__scheduled = [_handle for _handle in self.__scheduled if _handle._scheduled]
+			heapq.heapify(self.__scheduled)
+			self.__cancelled_timers = 0
+			self.__timer_arm()
+	
+	def __timer_arm(self):
+		"Re-arm the timer source for the earliest deadline, or disarm it."
+		
+		if self.__scheduled:
+			self.__timer.timer_update(max(1, ceil((self.__scheduled[0].when() - self.time()) * 1000))) # 0 would disarm the timer
+		else:
+			self.__timer.timer_update(0)
+	
+	def __timer_callback(self, data):
+		now = self.time()
+		while self.__scheduled and self.__scheduled[0].when() <= now:
+			handle = heapq.heappop(self.__scheduled)
+			handle._scheduled = False
+			if handle.cancelled():
+				self.__cancelled_timers = max(0, self.__cancelled_timers - 1)
+			else:
+				handle._run()
+		self.__timer_arm()
+		return 0
+	
+	def __wakeup_callback(self, fd, mask, data):
+		"Run callbacks from other threads and those that are ready now. Callbacks scheduled meanwhile run in the next event loop iteration."
+		
+		try:
+			while os.read(fd, 4096):
+				pass
+		except BlockingIOError:
+			pass
+		with self.__lock:
+			handles, self.__threadsafe = self.__threadsafe, deque()
+		for handle in handles:
+			if not handle.cancelled():
+				handle._run()
+		
+		self.__ready_pending = False
+		for n in range(len(self.__ready)):
+			handle = self.__ready.popleft()
+			if not handle.cancelled():
+				handle._run()
+		if self.__ready and not self.__ready_pending:
+			# the pipe is polled together with the other fds, so a coroutine looping on `sleep(0)` does not starve them
+			self.__ready_pending = True
+			self.__wake()
+		return 0
+	
+	# file descriptors
+	
+	def __add_fd(self, sources, fd, mask, callback, args):
+		"Register the callback; a fd that is already registered keeps its source and only the callback is replaced."
+		
+		handle = asyncio.Handle(callback, args, self, None)
+		fd = fd if isinstance(fd, int) else fd.fileno()
+		
+		if fd in sources:
+			previous, source = sources[fd]
+			previous.cancel()
+			sources[fd] = handle, source
+			return handle
+		
+		def dispatch(fd, mask, data):
+			current = sources.get(fd)
+			if current is not None and not current[0].cancelled():
+				current[0]._run()
+			return 0
+		
+		sources[fd] = handle, self.__event_loop.add_fd(fd, dispatch, mask)
+		return handle
+	
+	def __remove_fd(self, sources, fd):
+		fd = fd if isinstance(fd, int) else fd.fileno()
+		try:
+			handle, source = sources.pop(fd)
+		except KeyError:
+			return False
+		handle.cancel()
+		source.remove()
+		return True
+	
+	def add_reader(self, fd, callback, *args):
+		self.__add_fd(self.__readers, fd, EventLoop.FdMask.WL_EVENT_READABLE, callback, args)
+	
+	def remove_reader(self, fd):
+		return self.__remove_fd(self.__readers, fd)
+	
+	def add_writer(self, fd, callback, *args):
+		self.__add_fd(self.__writers, fd, EventLoop.FdMask.WL_EVENT_WRITABLE, callback, args)
+	
+	def remove_writer(self, fd):
+		return self.__remove_fd(self.__writers, fd)
+	
+	# signals
+	
+	def add_signal_handler(self, sig, callback, *args):
+		self.remove_signal_handler(sig)
+		handle = asyncio.Handle(callback, args, self, None)
+		self.__signals[sig] = handle, self.__event_loop.add_signal(sig, lambda signum, data: handle._run() or 0)
+	
+	def remove_signal_handler(self, sig):
+		try:
+			handle, source = self.__signals.pop(sig)
+		except KeyError:
+			return False
+		source.remove()
+		return True
+	
+	# futures and tasks
+	
+	def create_future(self):
+		return asyncio.Future(loop=self)
+	
+	def create_task(self, coro, *, name=None, context=None):
+		if self.__task_factory is not None:
+			task = self.__task_factory(self, coro, context=context) if context is not None else self.__task_factory(self, coro)
+			if name is not None:
+				task.set_name(name)
+			return task
+		return asyncio.Task(coro, loop=self, name=name, context=context)
+	
+	def set_task_factory(self, factory):
+		self.__task_factory = factory
+	
+	def get_task_factory(self):
+		return self.__task_factory
+	
+	def run_in_executor(self, executor, func, *args):
+		if executor is None:
+			if self.__executor is None:
+				self.__executor = ThreadPoolExecutor(thread_name_prefix='gwayco')
+			executor = self.__executor
+		return asyncio.wrap_future(executor.submit(func, *args), loop=self)
+	
+	def set_default_executor(self, executor):
+		self.__executor = executor
+	
+	# state
+	
+	def is_running(self):
+		return self.__running
+	
+	def is_closed(self):
+		return self.__closed
+	
+	def close(self):
+		"Remove all event sources owned by this loop. Call before the display is destroyed."
+		
+		if self.__closed:
+			return
+		self.__closed = True
+		
+		self.__timer.remove()
+		self.__scheduled.clear()
+		for sources in [self.__readers, self.__writers, self.__signals]:
+			for handle, source in sources.values():
+				source.remove()
+			sources.clear()
+		self.__ready.clear()
+		
+		self.__wakeup.remove()
+		os.close(self.__wakeup_read)
+		os.close(self.__wakeup_write)
+		
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=False)
+	
+	async def shutdown_asyncgens(self):
+		pass
+	
+	async def shutdown_default_executor(self):
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=True)
+	
+	# error handling
+	
+	def get_debug(self):
+		return self.__debug
+	
+	def set_debug(self, enabled):
+		self.__debug = enabled
+	
+	def get_exception_handler(self):
+		return self.__exception_handler
+	
+	def set_exception_handler(self, handler):
+		self.__exception_handler = handler
+	
+	def default_exception_handler(self, context):
+		import logging
+		logging.error(context.get('message', "Unhandled exception in event loop"), exc_info=context.get('exception'))
+	
+	def call_exception_handler(self, context):
+		if self.__exception_handler is None:
+			self.default_exception_handler(context)
+		else:
+			self.__exception_handler(self, context)
+
+
+async def read_lines(fd:int):
+	"""
+	Asynchronous generator of lines (bytes, without the newline) read from a file descriptor without ever blocking. Ends at EOF.
+	The reader stays registered while the generator runs and reads whenever the fd is readable, so level-triggered
+	readiness never spins while the consumer is busy.
+	"""
+	
+	loop = asyncio.get_running_loop()
+	os.set_blocking(fd, False)
+	chunks = deque() # data read so far, b'' at EOF
+	waiter = None
+	
+	def readable():
+		try:
+			data = os.read(fd, 65536)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b''
+		if not data:
+			loop.remove_reader(fd) # hangup stays readable forever
+		chunks.append(data)
+		if waiter is not None and not waiter.done():
+			waiter.set_result(None)
+	
+	loop.add_reader(fd, readable)
+	try:
+		buffer = b''
+		while True:
+			while not chunks:
+				waiter = loop.create_future()
+				await waiter
+			
+			data = chunks.popleft()
+			if not data:
+				if buffer:
+					yield buffer
+				return
+			
+			buffer += data
+			*lines, buffer = buffer.split(b'\n')
+			for line in lines:
+				yield line
+	finally:
+		loop.remove_reader(fd)
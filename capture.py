@@ -0,0 +1,193 @@
+import os
+import mmap
+
+from wlroots import ffi
+from wlroots.wlr_types.buffer import Buffer, BufferDataPtrAccessFlag
+
+from native import output_event_commit_buffer
+
+
+class PoolBuffer:
+	"Shared memory buffer. The memory is backed by a memfd so it can be passed to other processes."
+	
+	def __init__(self, size:int):
+		self.size = size
+		self.fd = os.memfd_create('gwayco-capture', os.MFD_CLOEXEC)
+		os.ftruncate(self.fd, size)
+		self.map = mmap.mmap(self.fd, size)
+		self.data = memoryview(self.map)
+	
+	def close(self):
+		self.data.release()
+		self.map.close()
+		os.close(self.fd)
+
+
+class BufferPool:
+	"Pool of shared memory buffers reused between captures. At most `limit` free buffers are kept, the oldest are evicted first."
+	
+	def __init__(self, limit:int=4):
+		self.limit = limit
+		self.free = []
+	
+	def acquire(self, size:int) -> PoolBuffer:
+		for n, buffer in enumerate(self.free):
+			if buffer.size == size:
+				del self.free[n]
+				return buffer
+		return PoolBuffer(size)
+	
+	def release(self, buffer:PoolBuffer):
+		self.free.append(buffer)
+		while len(self.free) > self.limit:
+			self.free.pop(0).close()
+	
+	def close(self):
+		for buffer in self.free:
+			buffer.close()
+		self.free.clear()
+
+
+class Frame:
+	"""
+	Captured frame. `pixels` is a memoryview of the shared buffer (no copy), rows are `stride` bytes long, pixel format is the DRM fourcc `format`.
+	`damage` is the list of `(x, y, width, height)` boxes that changed since the previous capture of the same output.
+	Call `release()` (or use as context manager) when done with the pixels.
+	"""
+	
+	def __init__(self, buffer:PoolBuffer, pool:BufferPool | None, width:int, height:int, stride:int, format:int, damage:list[tuple[int, int, int, int]]):
+		self.buffer = buffer
+		self.pool = pool
+		self.width = width
+		self.height = height
+		self.stride = stride
+		self.format = format
+		self.damage = damage
+	
+	@property
+	def pixels(self) -> memoryview:
+		return self.buffer.data[:self.stride * self.height]
+	
+	@property
+	def fd(self) -> int:
+		return self.buffer.fd
+	
+	def row(self, y:int) -> memoryview:
+		return self.buffer.data[y * self.stride:(y + 1) * self.stride]
+	
+	def release(self):
+		if self.buffer is not None and self.pool is not None:
+			self.pool.release(self.buffer)
+		self.buffer = None
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.release()
+
+
+class FrameCapture:
+	"""
+	Copy the rendered frame of an output into shared memory, taking the buffer from the output's commit event.
+	
+	Full captures get a fresh buffer from the pool. Damage-only captures share one persistent buffer per output, where only
+	the bands of rows that differ from the previous capture are rewritten; such frame is valid until the next capture.
+	
+	The output buffer is mapped directly, which works with the headless backend and the pixman renderer
+	(`WLR_BACKENDS=headless WLR_RENDERER=pixman`). GPU buffers can not be mapped; use the screencopy protocol for them.
+	"""
+	
+	band_height = 16
+	
+	def __init__(self, log, pool_limit:int=4):
+		self.log = log
+		self.pool = BufferPool(pool_limit)
+		self.requests = {}
+		self.persistent = {}
+	
+	def request(self, output, callback, damage_only:bool=False):
+		"""
+		Capture the next frame committed to `output`, calling `callback(frame)`. The caller should schedule a frame.
+		If the frame can not be captured, `callback(None)` is called.
+		"""
+		
+		self.requests.setdefault(id(output), []).append((callback, damage_only))
+	
+	def output_commit(self, output, event):
+		"Output commit event; fulfill pending capture requests of the output if a new buffer was committed."
+		
+		if id(output) not in self.requests:
+			return
+		
+		buffer_ptr = output_event_commit_buffer(event)
+		if buffer_ptr == ffi.NULL:
+			return # commit without a new frame (i.e. mode change), wait for the next one
+		
+		requests = self.requests.pop(id(output))
+		buffer = Buffer(buffer_ptr)
+		try:
+			data, format, stride = buffer.begin_data_ptr_access(BufferDataPtrAccessFlag.READ)
+		except RuntimeError:
+			self.log.error("capture: output buffer can not be mapped, use pixman renderer")
+			for callback, damage_only in requests:
+				callback(None)
+			return
+		
+		try:
+			width, height = output._ptr.width, output._ptr.height # output buffers have the size of the current mode
+			self.fulfill(output, requests, ffi.buffer(data, stride * height), width, height, stride, format)
+		finally:
+			buffer.end_data_ptr_access()
+	
+	def fulfill(self, output, requests:list, source, width:int, height:int, stride:int, format:int):
+		"Copy the frame in `source` for every request. Damage is computed once per frame and given to all damage-only requests."
+		
+		damage = None
+		for callback, damage_only in requests:
+			if damage_only:
+				if damage is None:
+					damage = self.__update_persistent(output, source, stride * height, width, stride)
+				frame = Frame(self.persistent[id(output)], None, width, height, stride, format, list(damage))
+			else:
+				target = self.pool.acquire(stride * height)
+				target.data[:] = source
+				frame = Frame(target, self.pool, width, height, stride, format, [(0, 0, width, height)])
+			callback(frame)
+	
+	def __update_persistent(self, output, source, size:int, width:int, stride:int) -> list[tuple[int, int, int, int]]:
+		"Bring the persistent buffer of the output up to date with `source`; return the damaged boxes."
+		
+		target = self.persistent.get(id(output))
+		if target is None or target.size != size:
+			if target is not None:
+				target.close()
+			target = self.persistent[id(output)] = PoolBuffer(size)
+			target.data[:] = source
+			return [(0, 0, width, size // stride)]
+		
+		damage = []
+		band = self.band_height * stride
+		for start in range(0, size, band):
+			end = min(start + band, size)
+			if target.data[start:end] != source[start:end]:
+				target.data[start:end] = source[start:end]
+				if damage and damage[-1][1] + damage[-1][3] == start // stride: # merge adjacent bands
+					damage[-1] = (0, damage[-1][1], width, damage[-1][3] + (end - start) // stride)
+				else:
+					damage.append((0, start // stride, width, (end - start) // stride))
+		return damage
+	
+	def output_destroy(self, output):
+		for callback, damage_only in self.requests.pop(id(output), []):
+			callback(None)
+		target = self.persistent.pop(id(output), None)
+		if target is not None:
+			target.close()
+	
+	def close(self):
+		for target in self.persistent.values():
+			target.close()
+		self.persistent.clear()
+		self.requests.clear()
+		self.pool.close()
@@ -0,0 +1,82 @@
+class Chrome:
+	"""
+	Scene nodes drawn by the compositor on behalf of the manager: background fill, gaps, borders, focus rings.
+	The manager creates named rects and trees and updates them with short requests, so that i.e. moving focus
+	recolors a rect instead of repainting the full-screen desktop client.
+	Nodes live under one of two root trees: `below` the desktop window or `above` it (but below other windows).
+	The desktop window is transparent where it draws no widgets, so `below` shows through there.
+	"""
+	
+	def __init__(self, scene_tree):
+		self.nodes = {}
+		self.parents = {}
+		self.nodes['below'] = scene_tree.append_tree(0, 0)
+		self.nodes['above'] = scene_tree.append_tree(0, 0)
+	
+	def place(self, desktop_node):
+		"Desktop window was mapped; sandwich it between the root trees."
+		
+		self.nodes['below'].place_below(desktop_node)
+		self.nodes['above'].place_above(desktop_node)
+	
+	@staticmethod
+	def color(color:str) -> tuple[float, float, float, float]:
+		"Parse `#rrggbb` or `#rrggbbaa` into premultiplied RGBA."
+		
+		if not color.startswith('#') or len(color) not in (7, 9):
+			raise ValueError(f"Bad color: {color}")
+		value = color[1:] + ('ff' if len(color) == 7 else '')
+		r, g, b, a = [int(value[_n:_n + 2], 16) / 255 for _n in range(0, 8, 2)]
+		return r * a, g * a, b * a, a
+	
+	def tree(self, name:str, parent:str, x:int, y:int):
+		self.__add(name, parent, self.nodes[parent].append_tree(x, y))
+	
+	def rect(self, name:str, parent:str, x:int, y:int, width:int, height:int, color:str):
+		self.__add(name, parent, self.nodes[parent].append_rect(x, y, width, height, self.color(color)))
+	
+	def __add(self, name:str, parent:str, node):
+		if name in self.nodes:
+			node.destroy()
+			raise ValueError(f"Node exists: {name}")
+		self.nodes[name] = node
+		self.parents[name] = parent
+	
+	def destroy(self, name:str):
+		"Destroy the node together with its children."
+		
+		if name not in self.parents:
+			raise KeyError(name) # root trees are destroyed with the scene
+		self.nodes.pop(name).destroy()
+		self.__forget(name)
+	
+	def __forget(self, name:str):
+		del self.parents[name]
+		for child in [_child for (_child, _parent) in self.parents.items() if _parent == name]:
+			del self.nodes[child]
+			self.__forget(child)
+	
+	def request(self, op:str, name:str, *args):
+		"Manager request `chrome <op> <name> [args...]`. Raises `KeyError`, `ValueError` or `AttributeError` (i.e. recoloring a tree) on bad arguments."
+		
+		match op, args:
+			case 'tree', (parent, x, y):
+				self.tree(name, parent, int(x), int(y))
+			case 'rect', (parent, x, y, width, height, color):
+				self.rect(name, parent, int(x), int(y), int(width), int(height), color)
+			case 'move', (x, y):
+				self.nodes[name].set_position(int(x), int(y))
+			case 'resize', (width, height):
+				self.nodes[name].set_size(int(width), int(height))
+			case 'color', (color,):
+				self.nodes[name].set_color(self.color(color))
+			case 'show', (enabled,):
+				self.nodes[name].set_enabled(enabled=enabled == '1')
+			case 'raise', ():
+				self.nodes[name].raise_to_top()
+			case 'lower', ():
+				self.nodes[name].lower_to_bottom()
+			case 'destroy', ():
+				self.destroy(name)
+			case _:
+				raise ValueError(f"Bad chrome request: {op} {' '.join(args)}")
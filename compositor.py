@@ -2,20 +2,23 @@
 
 
 import logging
+import os
 loglevel = logging.DEBUG
 logging.basicConfig(level=loglevel)
 
 from wlroots.util.log import log_init
 log_init(loglevel)
 
-from wlroots import ffi
+from wlroots import ffi, lib
 from wlroots.helper import build_compositor
 from wlroots.wlr_types import Cursor, DataDeviceManager, OutputLayout, Scene, Seat, XCursorManager, XdgShell, InputDevice, Output, Keyboard, SceneNodeType, SceneSurface, SceneBuffer, Buffer
 
 from wlroots.wlr_types.idle_notify_v1 import IdleNotifierV1
+from wlroots.wlr_types.idle_inhibit_v1 import IdleInhibitorManagerV1, IdleInhibitorV1
 from wlroots.wlr_types.layer_shell_v1 import LayerShellV1, LayerSurfaceV1
 from wlroots.wlr_types.foreign_toplevel_management_v1 import ForeignToplevelManagerV1
-from wlroots.wlr_types.xdg_decoration_v1 import XdgDecorationManagerV1, XdgToplevelDecorationV1
+from wlroots.wlr_types.xdg_decoration_v1 import XdgDecorationManagerV1, XdgToplevelDecorationV1, XdgToplevelDecorationV1Mode
+from wlroots.wlr_types.screencopy_v1 import ScreencopyManagerV1
 
 from wlroots.wlr_types.scene import SceneNode, SceneRect, SceneBuffer, SceneTree
 from wlroots.wlr_types.cursor import WarpMode
@@ -24,12 +27,27 @@ from wlroots.wlr_types.keyboard import KeyboardModifier, KeyboardKeyEvent
 from wlroots.wlr_types.pointer import PointerButtonEvent, PointerMotionAbsoluteEvent, PointerMotionEvent
 from wlroots.wlr_types.seat import RequestSetSelectionEvent
 from wlroots.wlr_types.xdg_shell import XdgSurface, XdgSurfaceRole
+from wlroots.util.box import Box
 from wlroots.util.clock import Timespec
 
+from pywayland import lib as wl_lib
 from pywayland.server import Display, Client, Listener
 from pywayland.protocol.wayland import WlKeyboard, WlSeat
 from xkbcommon import xkb
 
+from urllib.parse import quote, unquote
+from copy import deepcopy
+
+from capture import FrameCapture
+from native import output_schedule_frame
+from idle import IdlePolicy
+from launcher import Launcher
+from aioloop import WaylandEventLoop, read_lines
+from layout import compile_glade
+from replay import Recorder, RecordingWriter
+from chrome import Chrome
+from wallpaper import WallpaperCache
+
 
 class WlList:
 	def __init__(self, ptr, type, link, child_cls):
@@ -187,12 +205,39 @@ class SceneHelper(WlList):
 		return self.__class__(Scene.xdg_surface_create(self.__item, surface))
 
 
+class ListenerRegistry:
+	"Listeners attached to signals of wlroots objects, grouped by owner, so that all of them can be detached at once when the owner is destroyed."
+	
+	def __init__(self):
+		self.__listeners = {}
+	
+	def add(self, owner, signal, callback) -> Listener:
+		listener = Listener(callback)
+		signal.add(listener)
+		self.__listeners.setdefault(owner, []).append(listener)
+		return listener
+	
+	def remove(self, owner):
+		"Detach all listeners of the owner and drop references to them (and to everything their callbacks close over)."
+		
+		for listener in self.__listeners.pop(owner, []):
+			listener.remove()
+	
+	def clear(self):
+		for owner in list(self.__listeners.keys()):
+			self.remove(owner)
+	
+	def __len__(self):
+		return sum(len(_listeners) for _listeners in self.__listeners.values())
+
+
 class Server:
-	def __init__(self, log, cursor_size:int, seat_id:str):
+	def __init__(self, log, cursor_size:int, seat_id:str, idle_throttle:float=60, idle_off:float=300, idle_throttle_rate:float=5):
 		log.info("Creating server: cursor_size={cursor_size}, seat_id={seat_id}")
 		self.log = log
 		self.cursor_size = cursor_size
 		self.seat_id = seat_id
+		self.idle_timeouts = {'throttle_timeout':idle_throttle, 'off_timeout':idle_off, 'throttle_rate':idle_throttle_rate}
 		self.__reset()
 	
 	def __reset(self):
@@ -200,15 +245,40 @@ class Server:
 		
 		self.manager_in = None
 		self.manager_out = None
+		self.launcher = None
+		
+		self.layout = None # compiled from Glade, copied for every output
+		self.layout_slot = None
+		self.layouts = {} # output id -> Layout
+		self.layout_sizes = {} # widget id -> (width, height) reported by the manager
+		self.layout_requests = {} # window id -> (width, height) of the last interactive resize
+		self.layout_rects = {} # window id -> (x, y, width, height, decoration insets) last configured by the layout
 		
 		self.scene_node = {}
 		
 		self.focused_surface = None
 		self.pointed_surface = None
+		self.move_grab = None # (surface, cursor offset x, y) while a window is dragged by its title bar
 		
+		self.listeners = ListenerRegistry()
 		self.keyboards = []
+		self.active_keyboard = None
+		self.keymaps = {}
+		self.keybindings = {}
+		self.consumed_keys = set()
 		self.surfaces = {}
 		self.outputs = {}
+		self.decorations = {}
+		self.foreign_toplevels = {}
+		self.toplevel_updates = {}
+		self.toplevel_update_timer = None
+		self.output_configs = {}
+		self.output_change_timer = None
+		
+		self.frame_capture = FrameCapture(self.log)
+		self.wallpaper = None
+		self.wallpaper_cache = WallpaperCache(self.log)
+		self.wallpaper_nodes = {}
 	
 	def __enter__(self):
 		"Create and initialize all session objects; install event listeners."
@@ -227,11 +297,14 @@ class Server:
 			self.scene = Scene()
 			self.scene.attach_output_layout(self.output_layout)
 			self.scene_tree = SceneHelper(self.scene.tree)
+			self.chrome = Chrome(self.scene_tree)
 			self.idle_notify = IdleNotifierV1(self.display)
+			self.idle_inhibit = IdleInhibitorManagerV1(self.display)
 			self.layer_shell = LayerShellV1(self.display)
 			self.foreign_manager = ForeignToplevelManagerV1(self.display._ptr)
 			self.xkb_context = xkb.Context()
 			self.decoration_manager = XdgDecorationManagerV1(self.display._ptr)
+			self.screencopy_manager = ScreencopyManagerV1(self.display)
 			
 			#print(self.decoration_manager, dir(self.decoration_manager))
 			
@@ -240,6 +313,7 @@ class Server:
 			self.decoration_manager.new_toplevel_decoration_event.add(Listener(self.new_toplevel_decoration))
 			self.backend.new_input_event.add(Listener(self.new_input))
 			self.backend.new_output_event.add(Listener(self.new_output))
+			self.output_layout.change_event.add(Listener(self.output_layout_change))
 			self.cursor.motion_event.add(Listener(self.cursor_motion))
 			self.cursor.motion_absolute_event.add(Listener(self.cursor_motion_absolute))
 			self.cursor.button_event.add(Listener(self.cursor_button))
@@ -247,10 +321,14 @@ class Server:
 			self.cursor.frame_event.add(Listener(self.cursor_frame))
 			self.seat.request_set_cursor_event.add(Listener(self.request_set_cursor))
 			self.seat.request_set_selection_event.add(Listener(self.request_set_selection))
+			self.idle_inhibit.new_inhibitor_event.add(Listener(self.new_idle_inhibitor))
 			
 			self.socket = self.display.add_socket()
 			self.backend.__enter__()
 			self.event_loop = self.display.get_event_loop()
+			self.toplevel_update_timer = self.event_loop.add_timer(lambda data: self.toplevel_flush()) # one source, pywayland never frees removed ones
+			self.output_change_timer = self.event_loop.add_timer(lambda data: self.output_flush())
+			self.idle_policy = IdlePolicy(self, **self.idle_timeouts)
 		except Exception as error:
 			self.log.error("Error while constructing server.")
 			self.__exit__(type(error), error, None) # TODO: frame info
@@ -271,8 +349,8 @@ class Server:
 	# objects are created in that order and destroyed in reverse order
 	__wl_objects = [
 		'display', 'compositor', 'allocator', 'renderer', 'backend', 'subcompositor', 'device_manager',
-		'xdg_shell', 'output_layout', 'cursor', 'xcursor_manager', 'seat', 'scene', 'idle_notify',
-		'layer_shell', 'foreign_manager', 'xkb_context', 'decoration_manager', 'socket', 'event_loop'
+		'xdg_shell', 'output_layout', 'cursor', 'xcursor_manager', 'seat', 'scene', 'idle_notify', 'idle_inhibit',
+		'layer_shell', 'foreign_manager', 'xkb_context', 'decoration_manager', 'screencopy_manager', 'socket', 'event_loop', 'idle_policy'
 	]
 	
 	# objects that support context manager protocol
@@ -287,6 +365,17 @@ class Server:
 			self.log.error(str(exception))
 		
 		self.manager_in = self.manager_out = None
+		self.frame_capture.close()
+		self.wallpaper_cache.close()
+		self.listeners.clear()
+		
+		if self.toplevel_update_timer is not None:
+			self.toplevel_update_timer.remove()
+		if self.output_change_timer is not None:
+			self.output_change_timer.remove()
+		
+		if hasattr(self, 'idle_policy'):
+			self.idle_policy.close()
 		
 		for attr in reversed(self.__wl_objects):
 			self.log.debug(f"delete {attr}")
@@ -302,17 +391,17 @@ class Server:
 		
 		self.log.info("Server context exit success.")
 	
-	def manager_notify(self, method, role, event, surface):
+	def manager_notify(self, method, role, event, surface, *args):
 		if self.manager_in is None or self.display.destroyed:
 			return
 		
-		if role != 'OUTPUT':
+		if role not in ('OUTPUT', 'SEAT'):
 			id_ = id(surface.data)
 		else:
 			id_ = id(surface)
 		
 		print("manager_notify", self.notification_serial, method, role, hex(id(surface)), hex(id_), self.manager_in, self.display.destroyed)
-		self.manager_in.write(f"{self.notification_serial} {method} {role} {hex(id_)}\n".encode('utf-8'))
+		self.manager_in.write(" ".join([str(self.notification_serial), method, role, hex(id_), *map(str, args)]).encode('utf-8') + b"\n")
 		self.manager_in.flush()
 		self.notification_serial += 1
 	
@@ -324,9 +413,225 @@ class Server:
 			print("layer:", ['background', 'bottom', 'top', 'overlay'][state.layer])
 			print("actual size:", state.actual_width, state.actual_height, "desired size:", state.desired_width, state.desired_height)
 	
+	# server side decoration: border width, title bar height, colors of active and inactive frame
+	decoration_border = 2
+	decoration_title = 6
+	decoration_active = (0.3, 0.5, 0.8, 1.0)
+	decoration_inactive = (0.4, 0.4, 0.4, 1.0)
+	
 	def new_toplevel_decoration(self, listener, decoration:XdgToplevelDecorationV1):
-		self.log.info(f"new toplevel decoration {decoration}")
-		print(dir(decoration))
+		"Client supports xdg-decoration; always negotiate server side mode so that client buffers contain no titlebar nor shadows."
+		
+		surface = XdgSurface(decoration._ptr.surface) # wlroots 0.16: `struct wlr_xdg_surface *`, pywlroots wraps it as `Surface`
+		self.log.info(f"new toplevel decoration {surface}")
+		
+		id_ = id(surface.data) # surface may already be gone when the decoration is destroyed
+		self.decorations[id_] = {'decoration':decoration, 'frame':None, 'activated':False}
+		
+		self.listeners.add(id(decoration), decoration.request_mode_event, lambda listener, event: decoration.set_mode(XdgToplevelDecorationV1Mode.SERVER_SIDE))
+		self.listeners.add(id(decoration), decoration.destroy_event, lambda listener, event: self.decoration_destroy(id_, decoration))
+		decoration.set_mode(XdgToplevelDecorationV1Mode.SERVER_SIDE)
+	
+	def decoration_destroy(self, id_:int, decoration:XdgToplevelDecorationV1):
+		self.listeners.remove(id(decoration))
+		
+		try:
+			decoration = self.decorations.pop(id_)
+		except KeyError:
+			return
+		
+		if decoration['frame']:
+			for rect in decoration['frame']:
+				rect.destroy()
+	
+	def decoration_insets(self, surface:XdgSurface) -> tuple[int, int, int, int]:
+		"Space taken by server side decoration: left, top, right, bottom."
+		
+		if id(surface.data) not in self.decorations:
+			return 0, 0, 0, 0
+		b = self.decoration_border
+		return b, b + self.decoration_title, b, b
+	
+	def decoration_update(self, surface:XdgSurface, width:int, height:int):
+		"Draw (or move) frame rects around the window content of the provided size. Rects are children of the surface scene tree, below the surface."
+		
+		decoration = self.decorations[id(surface.data)]
+		left, top, right, bottom = self.decoration_insets(surface)
+		color = self.decoration_active if decoration['activated'] else self.decoration_inactive
+		
+		boxes = [
+			(-left, -top, width + left + right, top), # title bar
+			(-left, 0, left, height), # left border
+			(width, 0, right, height), # right border
+			(-left, height, width + left + right, bottom) # bottom border
+		]
+		
+		if decoration['frame'] is None:
+			decoration['frame'] = [surface.data.append_rect(*_box, color) for _box in boxes]
+			for rect in decoration['frame']:
+				rect.lower_to_bottom()
+		else:
+			for rect, (x, y, w, h) in zip(decoration['frame'], boxes):
+				rect.set_position(x, y)
+				rect.set_size(w, h)
+	
+	def decoration_title_at(self, node) -> XdgSurface | None:
+		"Toplevel whose title bar is the scene node, or None."
+		
+		for id_, decoration in self.decorations.items():
+			if decoration['frame'] and decoration['frame'][0].node._ptr == node._ptr and id_ in self.surfaces:
+				return self.surfaces[id_]
+		return None
+	
+	def move_begin(self, surface:XdgSurface):
+		"Start dragging the window with the pointer. Windows placed by the compositor layout do not move."
+		
+		if self.layout_of(id(surface.data)) is not None:
+			return
+		surface.data.raise_to_top()
+		self.toplevel_activate(surface, True)
+		self.keyboard_enter(surface.surface)
+		self.move_grab = surface, self.cursor.x - surface.data.x, self.cursor.y - surface.data.y
+	
+	def move_end(self):
+		"Button released; tell the manager where the window is now, including decoration."
+		
+		surface, dx, dy = self.move_grab
+		self.move_grab = None
+		left, top, right, bottom = self.decoration_insets(surface)
+		geometry = surface.get_geometry()
+		self.manager_notify('place', 'TOPLEVEL', None, surface, surface.data.x - left, surface.data.y - top, geometry.width + left + right, geometry.height + top + bottom)
+	
+	def decoration_activate(self, surface:XdgSurface, activated:bool):
+		"Recolor the frame of an activated or deactivated toplevel."
+		
+		try:
+			decoration = self.decorations[id(surface.data)]
+		except KeyError:
+			return
+		
+		decoration['activated'] = activated
+		if decoration['frame']:
+			color = self.decoration_active if activated else self.decoration_inactive
+			for rect in decoration['frame']:
+				rect.set_color(color)
+	
+	def toplevel_activate(self, surface:XdgSurface, activated:bool):
+		surface.set_activated(activated)
+		self.decoration_activate(surface, activated)
+		self.toplevel_update(surface, 'state')
+	
+	def toplevel_update(self, surface:XdgSurface, *fields):
+		"""
+		Schedule publishing of toplevel properties (`title`, `app_id`, `state`, `outputs`) to the foreign toplevel handle and to the manager.
+		Updates are coalesced and sent by a timer a millisecond later, so repeated title changes cost a single update.
+		"""
+		
+		if not self.toplevel_updates:
+			self.toplevel_update_timer.timer_update(1) # 0 would disarm the timer
+		self.toplevel_updates.setdefault(id(surface.data), set()).update(fields)
+	
+	def toplevel_flush(self):
+		"Timer callback; send all pending toplevel updates."
+		
+		updates, self.toplevel_updates = self.toplevel_updates, {}
+		
+		for id_, fields in updates.items():
+			try:
+				surface = self.surfaces[id_]
+			except KeyError:
+				continue # destroyed in the meantime
+			
+			try:
+				self.toplevel_publish(surface, fields)
+			except Exception as error: # one broken surface must not drop the updates of the others
+				self.log.error(f"toplevel update {fields}: {error!r}")
+	
+	def toplevel_publish(self, surface:XdgSurface, fields:set[str]):
+		"Send the changed properties of one toplevel to its foreign toplevel handle and to the manager."
+		
+		id_ = id(surface.data)
+		toplevel = surface.toplevel
+		handle = self.foreign_toplevels.get(id_)
+		
+		if 'title' in fields:
+			title = toplevel.title or ''
+			if handle is not None:
+				handle.set_title(title)
+			self.manager_notify('set_title', 'TOPLEVEL', None, surface, quote(title))
+		
+		if 'app_id' in fields:
+			app_id = toplevel.app_id or ''
+			if handle is not None:
+				handle.set_app_id(app_id)
+			self.manager_notify('set_app_id', 'TOPLEVEL', None, surface, quote(app_id))
+		
+		if handle is None:
+			return
+		
+		if 'state' in fields:
+			state = toplevel._ptr.scheduled # activation is published before the client acknowledges it
+			handle.set_activated(state.activated)
+			handle.set_maximized(state.maximized)
+			handle.set_fullscreen(state.fullscreen)
+		
+		if 'outputs' in fields:
+			self.foreign_toplevel_outputs(surface, handle)
+	
+	def foreign_toplevel_create(self, surface:XdgSurface):
+		"Publish mapped toplevel to taskbars through the foreign toplevel management protocol."
+		
+		id_ = id(surface.data)
+		handle = self.foreign_toplevels[id_] = self.foreign_manager.create_handle()
+		handle.outputs = set()
+		self.listeners.add(id(handle), handle.request_activate_event, lambda listener, event: self.manager_notify('activate', 'TOPLEVEL', event, surface))
+		self.listeners.add(id(handle), handle.request_maximize_event, lambda listener, event: self.manager_notify('maximize', 'TOPLEVEL', event, surface))
+		self.listeners.add(id(handle), handle.request_minimize_event, lambda listener, event: self.manager_notify('minimize', 'TOPLEVEL', event, surface))
+		self.listeners.add(id(handle), handle.request_fullscreen_event, lambda listener, event: self.manager_notify('fullscreen', 'TOPLEVEL', event, surface))
+		self.listeners.add(id(handle), handle.request_close_event, lambda listener, event: surface.send_close())
+		self.toplevel_update(surface, 'title', 'app_id', 'state', 'outputs')
+	
+	def foreign_toplevel_destroy(self, surface:XdgSurface):
+		handle = self.foreign_toplevels.pop(id(surface.data), None)
+		if handle is not None:
+			self.listeners.remove(id(handle))
+			handle.destroy()
+	
+	def foreign_toplevel_outputs(self, surface:XdgSurface, handle):
+		"Send output enter and leave events for outputs that the window started or stopped to overlap."
+		
+		coords = self.node_coords(surface.data.node)
+		geometry = surface.get_geometry()
+		
+		outputs = set()
+		if coords is not None: # window hidden from the scene is on no output
+			x, y = coords
+			for id_, output in self.outputs.items():
+				box = self.output_layout.get_box(output)
+				if x < box.x + box.width and box.x < x + geometry.width and y < box.y + box.height and box.y < y + geometry.height:
+					outputs.add(id_)
+		
+		for id_ in outputs - handle.outputs:
+			handle.output_enter(self.outputs[id_])
+		for id_ in handle.outputs - outputs:
+			if id_ in self.outputs:
+				handle.output_leave(self.outputs[id_])
+		handle.outputs = outputs
+	
+	def set_window_geometry(self, surface:XdgSurface, x:int, y:int, width:int, height:int):
+		"Place the window, including server side decoration if any, in the provided rectangle."
+		
+		left, top, right, bottom = self.decoration_insets(surface)
+		width = max(1, width - left - right)
+		height = max(1, height - top - bottom)
+		
+		surface.data.set_position(x + left, y + top)
+		surface.set_size(width, height)
+		
+		if id(surface.data) in self.decorations:
+			self.decoration_update(surface, width, height)
+		
+		self.toplevel_update(surface, 'outputs')
 	
 	def new_surface(self, listener, surface:XdgSurface):
 		"New surface was created by a client; add it to scene graph and install event listeners."
@@ -336,25 +641,26 @@ class Server:
 		#surface.configure
 		#surface.ack_configure
 		
-		surface.destroy_event.add(Listener(lambda listener, event: self.surface_destroy(listener, event, surface)))
-		surface.map_event.add(Listener(lambda listener, event: self.surface_map(listener, event, surface)))
-		surface.unmap_event.add(Listener(lambda listener, event: self.manager_notify('unmap', surface.role.name, event, surface)))
-		surface.new_popup_event.add(Listener(lambda listener, event: self.manager_notify('new_popup', surface.role.name, event, surface)))
+		self.listeners.add(id(surface), surface.destroy_event, lambda listener, event: self.surface_destroy(listener, event, surface))
+		self.listeners.add(id(surface), surface.map_event, lambda listener, event: self.surface_map(listener, event, surface))
+		self.listeners.add(id(surface), surface.unmap_event, lambda listener, event: self.surface_unmap(listener, event, surface))
+		self.listeners.add(id(surface), surface.new_popup_event, lambda listener, event: self.manager_notify('new_popup', surface.role.name, event, surface))
 		
 		if surface.role == XdgSurfaceRole.TOPLEVEL:
 			toplevel = surface.toplevel
 			
 			self.log.info(f" toplevel {toplevel.app_id} '{toplevel.title}' {toplevel.parent}")
 			
-			toplevel.request_move_event.add(Listener(lambda listener, event: self.manager_notify('move', 'TOPLEVEL', event, surface)))
-			toplevel.request_resize_event.add(Listener(lambda listener, event: self.manager_notify('resize', 'TOPLEVEL', event, surface)))
-			toplevel.request_maximize_event.add(Listener(lambda listener, event: self.manager_notify('maximize', 'TOPLEVEL', event, surface)))
-			toplevel.request_minimize_event.add(Listener(lambda listener, event: self.manager_notify('minimize', 'TOPLEVEL', event, surface)))
-			toplevel.request_fullscreen_event.add(Listener(lambda listener, event: self.manager_notify('fullscreen', 'TOPLEVEL', event, surface)))
-			toplevel.request_show_window_menu_event.add(Listener(lambda listener, event: self.manager_notify('show_window_menu', 'TOPLEVEL', event, surface)))
-			toplevel.set_parent_event.add(Listener(lambda listener, event: self.manager_notify('set_parent', 'TOPLEVEL', event, surface)))
-			toplevel.set_title_event.add(Listener(lambda listener, event: self.manager_notify('set_title', 'TOPLEVEL', event, surface)))
-			toplevel.set_app_id_event.add(Listener(lambda listener, event: self.manager_notify('set_app_id', 'TOPLEVEL', event, surface)))
+			self.listeners.add(id(surface), toplevel.request_move_event, lambda listener, event: self.manager_notify('move', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.request_resize_event, lambda listener, event: self.manager_notify('resize', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.request_maximize_event, lambda listener, event: self.manager_notify('maximize', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.request_minimize_event, lambda listener, event: self.manager_notify('minimize', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.request_fullscreen_event, lambda listener, event: self.manager_notify('fullscreen', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.request_show_window_menu_event, lambda listener, event: self.manager_notify('show_window_menu', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.set_parent_event, lambda listener, event: self.manager_notify('set_parent', 'TOPLEVEL', event, surface))
+			self.listeners.add(id(surface), toplevel.set_title_event, lambda listener, event: self.toplevel_update(surface, 'title'))
+			self.listeners.add(id(surface), toplevel.set_app_id_event, lambda listener, event: self.toplevel_update(surface, 'app_id'))
+			self.listeners.add(id(surface), surface.surface.commit_event, lambda listener, event: self.layout_update(surface))
 			
 			surface.data = self.scene_tree.append_surface(surface) # create scene node and assign to the `data` field
 		
@@ -363,9 +669,10 @@ class Server:
 			
 			self.log.info(" popup")
 			
-			popup.reposition_event.add(Listener(lambda listener, event: self.manager_notify('reposition', 'POPUP', event, surface)))
+			self.listeners.add(id(surface), popup.reposition_event, lambda listener, event: self.popup_reposition(listener, event, surface))
 			
 			surface.data = XdgSurface.from_surface(popup.parent).data.append_surface(surface) # find parent, find scene node from parent's `data` field, create new scene node, assign to popup's `data` field
+			self.popup_unconstrain(surface) # configure the popup synchronously, before the manager hears about it
 		
 		else:
 			self.log.warning(f"unknown xdg surface role {surface.role.name}")
@@ -374,6 +681,72 @@ class Server:
 		
 		if len(self.surfaces) > 1: # don't send notification for the very first window because it is the desktop
 			self.manager_notify('new_surface', surface.role.name, None, surface)
+			if surface.role == XdgSurfaceRole.POPUP:
+				self.manager_notify('place', 'POPUP', None, surface, *self.popup_geometry(surface))
+	
+	@staticmethod
+	def node_coords(node) -> tuple[int, int] | None:
+		"Position of the scene node in layout coordinates, or None if the node or any of its ancestors is disabled."
+		
+		lx, ly = ffi.new('int *'), ffi.new('int *')
+		if not lib.wlr_scene_node_coords(node._ptr, lx, ly):
+			return None
+		return lx[0], ly[0]
+	
+	def popup_toplevel(self, surface:XdgSurface) -> XdgSurface:
+		"Follow the chain of popup parents up to the toplevel (or layer surface) the popup belongs to."
+		
+		while surface.role == XdgSurfaceRole.POPUP:
+			parent = surface.popup.parent
+			if not parent.is_xdg_surface:
+				break
+			surface = XdgSurface.from_surface(parent)
+		return surface
+	
+	def popup_unconstrain(self, surface:XdgSurface):
+		"""
+		Place the popup according to its positioner rules (anchor, gravity, offset) and let wlroots slide, flip or resize it
+		so that it fits on the output showing the popup's anchor. The constraint box is expressed in the coordinate space
+		of the popup's toplevel, as wlroots expects. Schedules a configure event for the popup.
+		If the parent is not placed in the scene, the popup keeps the raw positioner geometry.
+		"""
+		
+		popup = surface.popup
+		toplevel = self.popup_toplevel(surface)
+		
+		parent_coords = self.node_coords(XdgSurface.from_surface(popup.parent).data.node)
+		toplevel_coords = self.node_coords(toplevel.data.node)
+		if parent_coords is None or toplevel_coords is None:
+			self.log.warning("popup parent not visible, leaving popup unconstrained")
+			return
+		
+		rules = popup._ptr.scheduled.rules
+		parent_x, parent_y = parent_coords
+		anchor_x = parent_x + rules.anchor_rect.x + rules.anchor_rect.width // 2
+		anchor_y = parent_y + rules.anchor_rect.y + rules.anchor_rect.height // 2
+		
+		output = self.output_layout.output_at(anchor_x, anchor_y)
+		if output is None:
+			output = self.output_layout.output_at(parent_x, parent_y)
+		if output is None:
+			self.log.warning("popup anchor outside of any output, leaving it unconstrained")
+			return
+		
+		output_box = self.output_layout.get_box(output)
+		toplevel_x, toplevel_y = toplevel_coords
+		popup.unconstrain_from_box(Box(output_box.x - toplevel_x, output_box.y - toplevel_y, output_box.width, output_box.height))
+	
+	def popup_geometry(self, surface:XdgSurface) -> tuple[int, int, int, int]:
+		"Geometry of the popup as scheduled by the last configure, relative to the parent surface."
+		
+		geometry = surface.popup._ptr.scheduled.geometry
+		return geometry.x, geometry.y, geometry.width, geometry.height
+	
+	def popup_reposition(self, listener, event, surface:XdgSurface):
+		"Client requested popup repositioning with new positioner rules; solve them again before notifying the manager."
+		
+		self.popup_unconstrain(surface)
+		self.manager_notify('reposition', 'POPUP', event, surface, *self.popup_geometry(surface))
 	
 	def surface_destroy(self, listener, event, surface:XdgSurface):
 		self.log.info(f"surface destroy {event} {surface}")
@@ -383,27 +756,187 @@ class Server:
 			self.log.info("unset pointed surface")
 			self.pointed_surface = None
 		
-		del self.surfaces[id(surface.data)]
+		self.decorations.pop(id(surface.data), None) # frame rects are destroyed together with the surface tree
+		self.layout_remove(surface)
+		self.foreign_toplevel_destroy(surface)
+		self.toplevel_updates.pop(id(surface.data), None)
+		self.surfaces.pop(id(surface.data), None)
+		self.listeners.remove(id(surface))
 		
 		if surface.data:
 			surface.data.destroy()
+			surface.data = None # release the handle, so that the scene helper can be collected
+	
+	def surface_unmap(self, listener, event, surface:XdgSurface):
+		if self.move_grab is not None and self.move_grab[0].data is surface.data:
+			self.move_grab = None
+		self.foreign_toplevel_destroy(surface)
+		self.layout_remove(surface)
+		self.manager_notify('unmap', surface.role.name, event, surface)
+	
+	def set_layout(self, path:str, root_id:str, slot_id:str):
+		"""
+		Lay out toplevels in the compositor, using container structure compiled from a Glade file. Every output gets its own copy.
+		Windows are added to the container `slot_id`; geometry requests from the manager only resize them, see `layout_resize`.
+		"""
+		
+		layout = compile_glade(path, root_id)
+		if layout.root.find(slot_id) is None:
+			raise KeyError(f"No container {slot_id} in {path}")
+		
+		self.layout = layout
+		self.layout_slot = slot_id
+		self.layouts = {}
+		self.layout_sizes = {}
+		self.layout_rects = {}
+		self.layout_sync()
+		for id_ in self.foreign_toplevels.keys(): # mapped toplevels, except the desktop
+			self.layout_add(self.surfaces[id_], *(self.node_coords(self.surfaces[id_].data.node) or (self.cursor.x, self.cursor.y)))
+		self.relayout()
+	
+	def set_layout_size(self, widget_id:str, width:int, height:int):
+		"Size of a widget of the layout as allocated by the manager (i.e. the menu bar). It applies on the first output, covered by the desktop window."
+		
+		if self.layout is None or self.layout.root.find(widget_id) is None:
+			raise KeyError(f"No widget {widget_id} in layout")
+		self.layout_sizes[widget_id] = width, height
+		self.relayout(set(list(self.outputs)[:1])) # the desktop window covers the first output
+	
+	def layout_sync(self) -> set[int]:
+		"Create layouts for new outputs; windows of removed outputs move to the first one. Return ids of outputs to relayout."
+		
+		if self.layout is None:
+			return set()
+		
+		orphans = []
+		for id_ in self.layouts.keys() - self.outputs.keys():
+			orphans.extend(self.layouts.pop(id_).windows.keys())
+		added = self.outputs.keys() - self.layouts.keys()
+		for id_ in added:
+			self.layouts[id_] = deepcopy(self.layout)
+		
+		if self.outputs and orphans:
+			first = next(iter(self.outputs))
+			for key in orphans:
+				self.layouts[first].add_window(self.layout_slot, key, self.layout_hint(self.surfaces[key]))
+			added.add(first)
+		return added
+	
+	def layout_output(self, id_:int) -> int | None:
+		"Id of the output whose layout contains the window, or None."
+		
+		for output_id, layout in self.layouts.items():
+			if id_ in layout.windows:
+				return output_id
+		return None
+	
+	def layout_of(self, id_:int):
+		"Layout containing the window, or None."
+		
+		output_id = self.layout_output(id_)
+		return self.layouts[output_id] if output_id is not None else None
+	
+	def layout_hint(self, surface:XdgSurface) -> tuple[int, int]:
+		"Minimum size requested by the client, including decoration, or the size of the last interactive resize if larger."
+		
+		state = surface.toplevel._ptr.current
+		left, top, right, bottom = self.decoration_insets(surface)
+		width, height = self.layout_requests.get(id(surface.data), (0, 0))
+		return max(width, state.min_width + left + right), max(height, state.min_height + top + bottom)
+	
+	def layout_add(self, surface:XdgSurface, x:float, y:float) -> int | None:
+		"Add the window to the layout of the output at the point, or of the first output. Return the output id."
+		
+		if not self.layouts:
+			return None
+		output = self.output_layout.output_at(x, y)
+		output_id = id(output) if output is not None and id(output) in self.layouts else next(iter(self.outputs))
+		self.layouts[output_id].add_window(self.layout_slot, id(surface.data), self.layout_hint(surface))
+		return output_id
+	
+	def layout_remove(self, surface:XdgSurface):
+		self.layout_requests.pop(id(surface.data), None)
+		self.layout_rects.pop(id(surface.data), None)
+		output_id = self.layout_output(id(surface.data))
+		if output_id is not None:
+			self.layouts[output_id].remove_window(id(surface.data))
+			self.relayout({output_id})
+	
+	def layout_update(self, surface:XdgSurface):
+		"Toplevel committed; relayout its output if its minimum size changed."
+		
+		output_id = self.layout_output(id(surface.data))
+		if output_id is not None and self.layouts[output_id].set_hint(id(surface.data), self.layout_hint(surface)):
+			self.relayout({output_id})
+	
+	def layout_resize(self, surface:XdgSurface, width:int, height:int):
+		"Interactive resize of a window in the layout; the size becomes its minimum and the layout is evaluated again."
+		
+		self.layout_requests[id(surface.data)] = width, height
+		self.layout_update(surface)
+	
+	def relayout(self, outputs:set[int]=None):
+		"""
+		Evaluate the layouts of the provided outputs (by id, all by default) and commit them.
+		Only windows whose rectangle changed are configured, so that unaffected clients do not redraw.
+		"""
+		
+		if not self.layouts:
+			return
+		
+		first = next(iter(self.outputs), None)
+		for output_id, output in self.outputs.items():
+			layout = self.layouts.get(output_id)
+			if layout is None or (outputs is not None and output_id not in outputs):
+				continue # layouts of added or removed outputs are synced by `output_flush`
+			
+			for widget_id, (width, height) in self.layout_sizes.items(): # widgets of the desktop window are only on the first output
+				layout.set_size(widget_id, *((width, height) if output_id == first else (0, 0)))
+			
+			box = self.output_layout.get_box(output)
+			for id_, rect in layout.allocate(box.x, box.y, box.width, box.height).items():
+				surface = self.surfaces[id_]
+				key = *rect, self.decoration_insets(surface)
+				if self.layout_rects.get(id_) != key:
+					self.layout_rects[id_] = key
+					self.set_window_geometry(surface, *rect)
+					self.manager_notify('place', 'TOPLEVEL', None, surface, *rect)
+			
+			output.commit()
+	
+	def surface_pid(self, surface:XdgSurface) -> int:
+		"Process id of the client owning the surface."
+		
+		client = Client(ptr=wl_lib.wl_resource_get_client(surface.surface._ptr.resource))
+		pid, uid, gid = client.get_credentials()
+		return pid
 	
 	def surface_map(self, listener, event, surface:XdgSurface):
 		self.log.info(f"surface map {event} {surface}")
 		
 		if len(self.surfaces) > 1:
+			if surface.role == XdgSurfaceRole.TOPLEVEL:
+				self.foreign_toplevel_create(surface)
+				if self.layouts:
+					self.relayout({self.layout_add(surface, self.cursor.x, self.cursor.y)})
+				if self.launcher is not None:
+					pid = self.surface_pid(surface)
+					latency = self.launcher.mapped(pid)
+					if latency is not None:
+						self.log.info(f"launch to first map: {latency * 1000:.1f} ms, pid {pid}")
+						self.manager_notify('launched', 'TOPLEVEL', event, surface, pid, f"{latency * 1000:.1f}")
 			self.manager_notify('map', surface.role.name, event, surface)
 			return
 		
 		# If len(self.surfaces) == 1 this is the desktop window. Maximize it.
-		surface.set_size(*list(self.outputs.values())[0].effective_resolution()) # maximize window
+		self.desktop_resize(surface)
 		surface.set_maximized(True)
-		surface.data.set_position(0, 0)
 		surface.data.raise_to_top()
+		self.chrome.place(surface.data.node)
 		surface.set_activated(True)
-		self.seat.keyboard_notify_enter(surface.surface, self.keyboards[0])
+		self.keyboard_enter(surface.surface)
 		
-		for output in server.outputs.values():
+		for output in self.outputs.values():
 			output.commit()
 	
 	def new_input(self, listener, input_device:InputDevice):
@@ -420,12 +953,12 @@ class Server:
 			
 			keyboard = Keyboard.from_input_device(input_device)
 			
-			keymap = self.xkb_context.keymap_new_from_names()
-			keyboard.set_keymap(keymap)
+			keyboard.set_keymap(self.keymap())
 			keyboard.set_repeat_info(25, 600)
 			
-			keyboard.modifiers_event.add(Listener(lambda listener, event: self.keyboard_modifiers(listener, event, keyboard)))
-			keyboard.key_event.add(Listener(lambda listener, event: self.keyboard_key(listener, event, keyboard)))
+			self.listeners.add(id(keyboard), keyboard.modifiers_event, lambda listener, event: self.keyboard_modifiers(listener, event, keyboard))
+			self.listeners.add(id(keyboard), keyboard.key_event, lambda listener, event: self.keyboard_key(listener, event, keyboard))
+			self.listeners.add(id(keyboard), input_device.destroy_event, lambda listener, event: self.keyboard_destroy(keyboard))
 			
 			self.keyboards.append(keyboard)
 		else:
@@ -441,6 +974,21 @@ class Server:
 		self.log.debug(f"seat capabilities: {capabilities}")
 		self.seat.set_capabilities(capabilities)
 	
+	def keyboard_destroy(self, keyboard:Keyboard):
+		self.log.info("keyboard destroy")
+		
+		self.listeners.remove(id(keyboard))
+		self.keyboards.remove(keyboard)
+		self.consumed_keys.clear()
+		if keyboard is self.active_keyboard:
+			self.active_keyboard = None
+	
+	def keyboard_enter(self, surface):
+		"Give keyboard focus to the surface, if there is any keyboard."
+		
+		if self.keyboards:
+			self.seat.keyboard_notify_enter(surface, self.active_keyboard or self.keyboards[0])
+	
 	def new_output(self, listener, output:Output):
 		"New output device (like a monitor or offscreen buffer) was added to the display."
 		
@@ -448,8 +996,9 @@ class Server:
 		
 		self.outputs[id(output)] = output
 		
-		output.destroy_event.add(Listener(lambda listener, _output: self.output_destroy(listener, output)))
-		output.frame_event.add(Listener(lambda listener, frame: self.output_frame(listener, frame, output)))
+		self.listeners.add(id(output), output.destroy_event, lambda listener, _output: self.output_destroy(listener, output))
+		self.listeners.add(id(output), output.frame_event, lambda listener, frame: self.output_frame(listener, frame, output))
+		self.listeners.add(id(output), output.commit_event, lambda listener, event: self.frame_capture.output_commit(output, event))
 		
 		output.init_render(self.allocator, self.renderer)
 		output.set_mode(output.preferred_mode())
@@ -457,13 +1006,151 @@ class Server:
 		output.commit()
 		self.output_layout.add_auto(output)		
 		
-		self.manager_notify('new_output', 'OUTPUT', None, output)
+		self.output_announce(output)
+	
+	def output_announce(self, output:Output):
+		"Tell the manager about the output, its modes (`<width>x<height>@<refresh mHz>`) and its configuration if already known."
+		
+		self.manager_notify('new_output', 'OUTPUT', None, output, *[f"{_mode.width}x{_mode.height}@{_mode.refresh_mhz}" for _mode in output.modes])
+		if id(output) in self.output_configs:
+			self.manager_notify('output_change', 'OUTPUT', None, output, *self.output_configs[id(output)])
+	
+	def set_output_mode(self, output:Output, width:int, height:int, refresh:int=0):
+		"Switch output to the mode of the provided size, with the refresh rate (mHz) closest to the requested one; custom mode if there is no such mode."
+		
+		modes = [_mode for _mode in output.modes if (_mode.width, _mode.height) == (width, height)]
+		if modes:
+			output.set_mode(min(modes, key=lambda _mode: abs(_mode.refresh_mhz - refresh)))
+		else:
+			output.set_custom_mode(width, height, refresh)
+		output.commit() # the output layout reports the change, see `output_layout_change`
+	
+	def output_config(self, output:Output) -> tuple:
+		box = self.output_layout.get_box(output)
+		return box.x, box.y, box.width, box.height, output._ptr.scale, output._ptr.transform
+	
+	def output_layout_change(self, listener, data):
+		"""
+		Output was added, removed, moved or changed mode, scale or transform.
+		Docking produces a burst of these, so the changes are applied together by a timer a millisecond after the last one.
+		"""
+		
+		self.output_change_timer.timer_update(1) # 0 would disarm the timer
+	
+	def output_flush(self):
+		"""
+		Timer callback; reconfigure what the output changes affect, in a single transaction. The desktop window is resized only
+		if the first output changed and the compositor layout only on changed outputs; other toplevels are touched only if they
+		overlap a changed output, or are moved to the first output if they no longer overlap any.
+		"""
+		
+		configs = {_id: self.output_config(_output) for (_id, _output) in self.outputs.items()}
+		changed = [_id for _id in configs.keys() | self.output_configs.keys() if configs.get(_id) != self.output_configs.get(_id)]
+		boxes = [_config[:4] for _id in changed for _config in (configs.get(_id), self.output_configs.get(_id)) if _config is not None]
+		first_changed = list(configs.items())[:1] != list(self.output_configs.items())[:1]
+		self.output_configs = configs
+		
+		if not changed or not self.outputs:
+			return
+		
+		self.log.info(f"outputs changed: {len(changed)}")
+		
+		for id_ in changed:
+			if id_ in configs:
+				self.manager_notify('output_change', 'OUTPUT', None, self.outputs[id_], *configs[id_])
+				try:
+					self.wallpaper_show(self.outputs[id_], self.wallpaper)
+				except Exception as error: # GLib.Error
+					self.log.error(f"wallpaper: {error}")
+		
+		for n, (id_, surface) in enumerate(self.surfaces.items()):
+			if n == 0:
+				if first_changed:
+					self.desktop_resize(surface)
+				continue
+			
+			if surface.role != XdgSurfaceRole.TOPLEVEL or id_ not in self.foreign_toplevels:
+				continue # popups follow their parents, unmapped windows are placed on map
+			if self.layout_of(id_) is not None:
+				continue # see `relayout` below
+			
+			coords = self.node_coords(surface.data.node)
+			if coords is None:
+				continue # hidden windows are checked when shown
+			x, y = coords
+			geometry = surface.get_geometry()
+			
+			def overlaps(box):
+				bx, by, bw, bh = box
+				return x < bx + bw and bx < x + geometry.width and y < by + bh and by < y + geometry.height
+			
+			if not any(overlaps(_box) for _box in boxes):
+				continue
+			
+			if not any(overlaps(_config[:4]) for _config in configs.values()): # output left, bring the window back
+				bx, by, bw, bh = next(iter(configs.values()))[:4]
+				left, top, right, bottom = self.decoration_insets(surface)
+				width, height = min(geometry.width + left + right, bw), min(geometry.height + top + bottom, bh)
+				self.set_window_geometry(surface, bx + (bw - width) // 2, by + (bh - height) // 2, width, height)
+			else:
+				self.toplevel_update(surface, 'outputs')
+		
+		relaid = set()
+		if self.layouts:
+			relaid = self.layout_sync() | {_id for _id in changed if _id in configs}
+			self.relayout(relaid) # commits these outputs
+		for id_, output in self.outputs.items():
+			if id_ not in relaid:
+				output.commit()
+	
+	def set_wallpaper(self, path:str | None):
+		"Show the image at the bottom of every output, below the desktop window. None removes the wallpaper."
+		
+		if path is not None:
+			self.wallpaper_cache.load(path)
+		for output in self.outputs.values():
+			self.wallpaper_show(output, path)
+			output.commit()
+		self.wallpaper = path # only once shown, output changes show it again
+	
+	def wallpaper_show(self, output:Output, path:str | None):
+		"Place the wallpaper variant matching the output's size and scale as a static scene buffer."
+		
+		self.wallpaper_hide(output)
+		if path is None:
+			return
+		
+		box = self.output_layout.get_box(output)
+		scale = output._ptr.scale
+		buffer = self.wallpaper_cache.get(self.allocator, self.renderer, path, round(box.width * scale), round(box.height * scale))
+		if buffer is None:
+			return
+		
+		node = self.wallpaper_nodes[id(output)] = self.scene_tree.append_buffer(box.x, box.y, buffer)
+		lib.wlr_scene_buffer_set_dest_size(node.get_item()._ptr, box.width, box.height)
+		node.lower_to_bottom()
+	
+	def wallpaper_hide(self, output:Output):
+		node = self.wallpaper_nodes.pop(id(output), None)
+		if node is not None:
+			node.destroy()
+	
+	def desktop_resize(self, surface:XdgSurface):
+		"Cover the first output with the desktop window."
+		
+		output = next(iter(self.outputs.values()))
+		box = self.output_layout.get_box(output)
+		surface.set_size(*output.effective_resolution())
+		surface.data.set_position(box.x, box.y)
 	
 	def output_destroy(self, listener, output):
 		self.log.info(f"destroy output")
 		
 		self.manager_notify('output_destroy', 'OUTPUT', None, output)
 		
+		self.frame_capture.output_destroy(output)
+		self.wallpaper_hide(output)
+		self.listeners.remove(id(output))
 		del self.outputs[id(output)]
 		if not self.outputs: # last window closed
 			self.display.terminate()
@@ -473,17 +1160,26 @@ class Server:
 		
 		#self.log.info("frame")
 		#self.log.debug(f" frame {frame} {output}")
+		if not self.idle_policy.frame_allowed(output):
+			return
+		
 		scene_output = self.scene.get_scene_output(output)
 		#self.log.debug(f" scene_output = {scene_output}")
 		scene_output.commit()
 		scene_output.send_frame_done(Timespec.get_monotonic_time())
 	
+	def capture_output(self, output:Output, callback, damage_only:bool=False):
+		"Capture the next rendered frame of the output into shared memory, see `FrameCapture`. External clients can use the screencopy protocol instead."
+		
+		self.frame_capture.request(output, callback, damage_only)
+		output_schedule_frame(output)
+	
 	def cursor_motion(self, listener, event_motion:PointerMotionEvent):
 		"Relative cursor motion event. Argument contains `delta_x` and `delta_y` fields."
 		
 		self.cursor.move(event_motion.delta_x, event_motion.delta_y, input_device=event_motion.pointer.base)
 		#self.log.debug(f"relative cursor motion event: {self.cursor.x}, {self.cursor.y}")
-		self.idle_notify.notify_activity(self.seat)
+		self.idle_policy.activity()
 		
 		self.__pointer_motion(event_motion.time_msec)
 	
@@ -492,11 +1188,17 @@ class Server:
 		
 		self.cursor.warp(WarpMode.AbsoluteClosest, event_motion_absolute.x, event_motion_absolute.y, input_device=event_motion_absolute.pointer.base)
 		#self.log.debug(f"absolute cursor motion event: {self.cursor.x}, {self.cursor.y}")
-		self.idle_notify.notify_activity(self.seat)
+		self.idle_policy.activity()
 		
 		self.__pointer_motion(event_motion_absolute.time_msec)
 	
 	def __pointer_motion(self, time_msec):
+		if self.move_grab is not None:
+			surface, dx, dy = self.move_grab
+			surface.data.set_position(round(self.cursor.x - dx), round(self.cursor.y - dy))
+			self.toplevel_update(surface, 'outputs')
+			return
+		
 		#pointed_scene_node = None
 		pointed_surface = None
 		
@@ -544,7 +1246,7 @@ class Server:
 				#print("a", self.pointed_surface)
 				xdg_surface = XdgSurface.from_surface(self.pointed_surface)
 				if xdg_surface.role == XdgSurfaceRole.TOPLEVEL:
-					xdg_surface.set_activated(False)
+					self.toplevel_activate(xdg_surface, False)
 				self.manager_notify('deactivate', xdg_surface.role.name, None, xdg_surface)
 			
 			if pointed_surface:
@@ -554,9 +1256,9 @@ class Server:
 				if pointed_surface.is_xdg_surface:
 					xdg_surface = XdgSurface.from_surface(pointed_surface)
 					if xdg_surface.role == XdgSurfaceRole.TOPLEVEL:
-						xdg_surface.set_activated(True)
+						self.toplevel_activate(xdg_surface, True)
 					self.manager_notify('activate', xdg_surface.role.name, None, xdg_surface)
-				server.seat.keyboard_notify_enter(pointed_surface, server.keyboards[0])
+				self.keyboard_enter(pointed_surface)
 			
 			else:
 				self.seat.pointer_clear_focus()
@@ -573,32 +1275,148 @@ class Server:
 		#	self.pointed_scene_node = pointed_scene_node
 	
 	def cursor_button(self, listener, event:PointerButtonEvent):
-		self.seat.pointer_notify_button(event.time_msec, event.button, event.button_state)
 		self.log.debug(f"cursor button event: {self.cursor.x}, {self.cursor.y}, {event.button}, {event.button_state}")
-		self.idle_notify.notify_activity(self.seat)
+		self.idle_policy.activity()
+		
+		if self.move_grab is not None: # the client did not see the press, so it does not get the release either
+			if event.button_state == ButtonState.RELEASED:
+				self.move_end()
+			return
+		
+		if event.button_state == ButtonState.PRESSED:
+			node_x_y = self.scene.tree.node.node_at(self.cursor.x, self.cursor.y)
+			surface = self.decoration_title_at(node_x_y[0]) if node_x_y is not None else None
+			if surface is not None:
+				self.move_begin(surface)
+				if self.move_grab is not None:
+					return
+		
+		self.seat.pointer_notify_button(event.time_msec, event.button, event.button_state)
 	
 	def cursor_axis(self, listener, event):
 		self.seat.pointer_notify_axis(event.time_msec, event.orientation, event.delta, event.delta_discrete, event.source)
+		self.idle_policy.activity()
 	
 	def cursor_frame(self, listener, event):
 		self.seat.pointer_notify_frame()
 	
+	def keymap(self, rules:str=None, model:str=None, layout:str=None, variant:str=None, options:str=None):
+		"""
+		Return compiled keymap for the provided RMLVO names. Missing names are taken from `XKB_DEFAULT_*` environment variables.
+		Keymaps are compiled once and shared by all keyboards with the same names.
+		"""
+		
+		rmlvo = tuple(_value if _value is not None else os.environ.get('XKB_DEFAULT_' + _name.upper()) for _name, _value in zip(['rules', 'model', 'layout', 'variant', 'options'], [rules, model, layout, variant, options]))
+		
+		try:
+			return self.keymaps[rmlvo]
+		except KeyError:
+			pass
+		
+		self.log.info(f"compile keymap {rmlvo}")
+		keymap = self.keymaps[rmlvo] = self.xkb_context.keymap_new_from_names(*rmlvo)
+		return keymap
+	
+	__modifier_names = {
+		'shift': KeyboardModifier.SHIFT,
+		'ctrl': KeyboardModifier.CTRL,
+		'control': KeyboardModifier.CTRL,
+		'alt': KeyboardModifier.ALT,
+		'mod1': KeyboardModifier.ALT,
+		'mod3': KeyboardModifier.MOD3,
+		'logo': KeyboardModifier.LOGO,
+		'super': KeyboardModifier.LOGO,
+		'mod4': KeyboardModifier.LOGO,
+		'mod5': KeyboardModifier.MOD5
+	}
+	
+	def set_keybindings(self, bindings:list[str]):
+		"""
+		Replace the keybinding table. Each binding has the form `Mod+Mod+Keysym:action`, i.e. `Ctrl+Alt+BackSpace:quit`.
+		Keysym is matched as produced by the keymap with the modifiers applied, so use `Shift+Q`, not `Shift+q`.
+		Action `quit` terminates the compositor, all other actions are forwarded to the manager.
+		"""
+		
+		keybindings = {}
+		for binding in bindings:
+			combination, action = binding.rsplit(':', 1)
+			*modifier_names, keysym_name = combination.split('+')
+			
+			modifiers = 0
+			for name in modifier_names:
+				if name.lower() in ('caps', 'mod2'):
+					raise ValueError(f"Lock modifier {name} can not be bound, caps lock and num lock are ignored when matching")
+				try:
+					modifiers |= self.__modifier_names[name.lower()]
+				except KeyError:
+					raise ValueError(f"Unknown modifier: {name}")
+			
+			keysym = xkb.keysym_from_name(keysym_name)
+			if not keysym:
+				raise ValueError(f"Unknown keysym: {keysym_name}")
+			
+			keybindings[modifiers, keysym] = action
+		
+		self.keybindings = keybindings
+		self.log.info(f"keybindings: {len(keybindings)}")
+	
+	def keybinding_action(self, action:str):
+		self.log.info(f"keybinding {action}")
+		if action == 'quit':
+			self.display.terminate()
+		else:
+			self.manager_notify('keybinding', 'SEAT', None, self.seat, action)
+	
+	def __activate_keyboard(self, keyboard:Keyboard):
+		"Make the keyboard active on the seat. Only call into wlroots if the device actually changed."
+		
+		if keyboard is not self.active_keyboard:
+			self.seat.set_keyboard(keyboard)
+			self.active_keyboard = keyboard
+	
 	def keyboard_modifiers(self, listener, event, keyboard:Keyboard):
-		self.log.debug(f"keyboard modifiers {event} {keyboard}")
-		#keyboard = Keyboard.from_input_device(input_device)
-		self.seat.set_keyboard(keyboard)
+		self.__activate_keyboard(keyboard)
 		self.seat.keyboard_notify_modifiers(keyboard.modifiers)
 	
 	def keyboard_key(self, listener, key_event:KeyboardKeyEvent, keyboard:Keyboard):
-		if not hasattr(self, 'idle_notify'):
+		if not hasattr(self, 'idle_policy'):
 			"If the compositor has been closed using key combination, abort sequence, as the key release events would be triggered on finished object."
 			listener.remove()
 			return
-		self.log.debug(f"keyboard key {key_event} {keyboard}")
-		self.idle_notify.notify_activity(self.seat)
-		self.seat.set_keyboard(keyboard)
+		self.idle_policy.activity()
+		
+		if key_event.state == WlKeyboard.key_state.pressed:
+			if self.keybindings:
+				keycode = key_event.keycode + 8 # libinput keycode -> xkbcommon
+				syms_out = ffi.new('const xkb_keysym_t **')
+				nsyms = lib.xkb_state_key_get_syms(keyboard._ptr.xkb_state, keycode, syms_out)
+				modifiers = keyboard.modifier & ~(KeyboardModifier.CAPS | KeyboardModifier.MOD2) # ignore caps lock and num lock
+				for n in range(nsyms):
+					try:
+						action = self.keybindings[modifiers, syms_out[0][n]]
+					except KeyError:
+						continue
+					self.consumed_keys.add(key_event.keycode) # don't send the release event to the client either
+					self.keybinding_action(action)
+					return
+		elif key_event.keycode in self.consumed_keys:
+			self.consumed_keys.remove(key_event.keycode)
+			return
+		
+		self.__activate_keyboard(keyboard)
 		self.seat.keyboard_notify_key(key_event)
 	
+	def new_idle_inhibitor(self, listener, inhibitor:IdleInhibitorV1):
+		"Client (like a video player) asks to keep the outputs on while its surface exists."
+		
+		self.log.info("new idle inhibitor")
+		self.idle_policy.inhibit(True)
+		self.listeners.add(id(inhibitor), inhibitor.destroy_event, lambda listener, event: self.idle_inhibitor_destroy(inhibitor))
+	
+	def idle_inhibitor_destroy(self, inhibitor:IdleInhibitorV1):
+		self.listeners.remove(id(inhibitor))
+		self.idle_policy.inhibit(False)
+	
 	def request_set_cursor(self, listener, event):
 		self.log.debug("seat request set cursor")
 		self.cursor.set_surface(event.surface, event.hotspot)
@@ -609,7 +1427,7 @@ class Server:
 
 
 if __name__ == '__main__':
-	import sys, os, signal
+	import sys, signal, asyncio
 	from subprocess import Popen, PIPE
 	
 	if len(sys.argv) < 3:
@@ -619,7 +1437,12 @@ if __name__ == '__main__':
 	seat_id = sys.argv[1]
 	desktop = sys.argv[2:]
 	
-	with Server(log=logging, cursor_size=24, seat_id=seat_id) as server:
+	idle_timeouts = {} # seconds of idle before throttling and before switching outputs off, frames per second when throttled
+	for key, variable in [('idle_throttle', 'GWAYCO_IDLE_THROTTLE'), ('idle_off', 'GWAYCO_IDLE_OFF'), ('idle_throttle_rate', 'GWAYCO_IDLE_RATE')]:
+		if os.environ.get(variable):
+			idle_timeouts[key] = float(os.environ[variable])
+	
+	with Server(log=logging, cursor_size=24, seat_id=seat_id, **idle_timeouts) as server:
 		server.event_loop.add_signal(signal.SIGINT, lambda signum, _: server.display.terminate())
 		
 		environ = os.environ.copy()
@@ -635,6 +1458,11 @@ if __name__ == '__main__':
 		server.manager_in = manager.stdin
 		server.manager_out = manager.stdout
 		
+		recorder = None
+		if environ.get('GWAYCO_RECORD'): # log of manager protocol for `replay.py`
+			recorder = Recorder(environ['GWAYCO_RECORD'])
+			server.manager_in = RecordingWriter(manager.stdin, recorder)
+		
 		def manager_request(msg):
 			match msg.split():
 				case [message_id, 'map', surface_id]:
@@ -668,8 +1496,56 @@ if __name__ == '__main__':
 						surface = server.surfaces[int(surface_id, 16)]
 					except KeyError:
 						return
-					surface.data.set_position(int(x), int(y))
-					surface.set_size(int(w), int(h))
+					if server.layout_of(int(surface_id, 16)) is None:
+						server.set_window_geometry(surface, int(x), int(y), int(w), int(h))
+					else: # windows in compositor layout are placed by the compositor
+						server.layout_resize(surface, int(w), int(h))
+					
+					for output in server.outputs.values():
+						output.commit()
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'output_mode', output_id, width, height, *refresh]:
+					try:
+						output = server.outputs[int(output_id, 16)]
+					except KeyError:
+						return
+					server.set_output_mode(output, int(width), int(height), int(refresh[0]) if refresh else 0)
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'launch', *argv] if argv:
+					server.launcher.launch([unquote(_arg) for _arg in argv])
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'layout', path, root_id, slot_id]:
+					try:
+						server.set_layout(unquote(path), root_id, slot_id)
+					except (OSError, KeyError, ValueError) as error:
+						server.log.error(f"layout: {error}")
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'layout_size', widget_id, width, height]:
+					try:
+						server.set_layout_size(widget_id, int(width), int(height))
+					except (KeyError, ValueError) as error:
+						server.log.error(f"layout_size: {error}")
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'chrome', op, name, *args]:
+					try:
+						server.chrome.request(op, name, *args)
+					except (KeyError, ValueError, AttributeError) as error:
+						server.log.error(f"chrome: {op} {name}: {error!r}")
 					
 					for output in server.outputs.values():
 						output.commit()
@@ -677,6 +1553,24 @@ if __name__ == '__main__':
 					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
 					server.manager_in.flush()
 				
+				case [message_id, 'wallpaper', *path]:
+					try:
+						server.set_wallpaper(unquote(path[0]) if path else None)
+					except Exception as error: # GLib.Error, gi is only imported when needed
+						server.log.error(f"wallpaper: {error}")
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
+				case [message_id, 'bind', *bindings]:
+					try:
+						server.set_keybindings(bindings)
+					except (ValueError, KeyError) as error:
+						server.log.error(f"bad keybinding: {error}")
+					
+					server.manager_in.write(f"@ {message_id}\n".encode('utf-8'))
+					server.manager_in.flush()
+				
 				#case [message_id, 'focus', surface_id]:
 				#	try:
 				#		surface = server.surfaces[int(surface_id, 16)]
@@ -694,14 +1588,34 @@ if __name__ == '__main__':
 				case default:
 					print("default", default)	
 		
-		server.event_loop.add_fd(manager.stdout.fileno(), lambda _a, fd, _b: manager_request(manager.stdout.readline()[:-1].decode('utf-8')))
+		loop = WaylandEventLoop(server.event_loop)
+		asyncio.set_event_loop(loop)
+		server.launcher = Launcher(server.log, loop, environ, lambda argv, message: server.manager_notify('launch_failed', 'SEAT', None, server.seat, quote(argv[0]), quote(message)))
+		
+		async def manager_reader():
+			"Dispatch manager requests; partial lines are buffered instead of blocking the event loop."
+			async for line in read_lines(manager.stdout.fileno()):
+				if recorder is not None:
+					recorder.record('<', line.decode('utf-8'))
+				try:
+					manager_request(line.decode('utf-8'))
+				except Exception as error: # a bad request must not stop processing of the following ones
+					server.log.error(f"manager request {line!r}: {error!r}")
+		
+		reader = loop.create_task(manager_reader())
 		
 		for output in server.outputs.values():
-			server.manager_notify('new_output', 'OUTPUT', None, output)
+			server.output_announce(output)
 		
-		server.display.run()
+		loop.run_display(server.display)
 		
+		reader.cancel() # readers remove their fd sources before the loop is closed
+		server.launcher.close()
+		loop.run_until_complete(asyncio.gather(reader, server.launcher.reader, return_exceptions=True))
+		loop.close()
 		manager.terminate()
+		if recorder is not None:
+			recorder.close()
 		
 		server.log.info("bye")
 
@@ -7,6 +7,7 @@ gi.require_version('Gtk', '3.0')
 
 from gi.repository import Gtk, GLib
 from time import time
+from urllib.parse import quote, unquote
 
 
 class BuilderExtension:
@@ -28,10 +29,24 @@ class DesktopLayer(BuilderExtension):
 		super().__init__('stack.glade', translation, ['bin_layer'])
 
 
-class Desktop(BuilderExtension):
+class TilingBars(BuilderExtension):
+	"Menu bar and panel of `tiling.glade`, the layout the compositor uses for toplevels."
+	
 	def __init__(self, translation):
+		super().__init__('tiling.glade', translation, ['tiling_menubar', 'tiling_panel'])
+
+
+class Desktop(BuilderExtension):
+	border_width = 2
+	border_colors = {True: '#3080ffff', False: '#707070ff'} # activated, deactivated
+	
+	def __init__(self, translation, manager, border):
 		super().__init__('desktop.glade', translation, ['window_main'])
 		
+		visual = self.window_main.get_screen().get_rgba_visual()
+		if visual is not None: # transparent where no widget draws, so the wallpaper and chrome below the window show through
+			self.window_main.set_visual(visual)
+		
 		self.background_layer = DesktopLayer(translation)
 		self.bottom_layer = DesktopLayer(translation)
 		self.middle_layer = DesktopLayer(translation)
@@ -46,12 +61,38 @@ class Desktop(BuilderExtension):
 		
 		self.toplevel_stack = Gtk.Stack()
 		self.middle_layer.frame_main.add(self.toplevel_stack)
+		
+		self.modes = []
+		self.geometry = None
+		
+		self.manager = manager
+		self.border = border # name of the chrome rect around the last activated toplevel
+		self.bordered = None
+		self.active = False
+		self.border_state = None
+		manager.chrome('rect', border, 'above', 0, 0, 0, 0, self.border_colors[False])
+		manager.chrome('show', border, 0)
 	
-	def add_toplevel(self, toplevel):
+	def add_tiling_bars(self, translation):
+		"Show the menu bar and the panel of the compositor layout around the area where it places toplevels."
+		
+		bars = TilingBars(translation)
+		self.middle_layer.box_top_exclusive.add(bars.tiling_menubar)
+		self.middle_layer.box_bottom_exclusive.add(bars.tiling_panel)
+		return bars
+	
+	def add_toplevel(self, toplevel, stacked=True):
+		"Toplevels placed by the compositor layout are not `stacked`, so that they are neither resized nor hidden by the stack."
 		toplevel.desktop = self
-		self.toplevel_stack.add_named(toplevel, str(time()))
+		if stacked:
+			self.toplevel_stack.add_named(toplevel, str(time()))
 	
 	def remove_toplevel(self, toplevel):
+		if self.bordered is toplevel:
+			self.bordered = None
+			self.update_border()
+		if toplevel.get_parent() is not self.toplevel_stack:
+			return
 		self.toplevel_stack.remove(toplevel)
 		try:
 			next_toplevel = self.toplevel_stack.get_children()[0]
@@ -62,10 +103,53 @@ class Desktop(BuilderExtension):
 		self.toplevel_stack.queue_draw()
 	
 	def activate_toplevel(self, toplevel):
-		self.toplevel_stack.set_visible_child(toplevel)
+		if toplevel.get_parent() is self.toplevel_stack:
+			self.toplevel_stack.set_visible_child(toplevel)
+		self.bordered = toplevel
+		self.active = True
+		self.update_border()
 	
 	def deactivate_toplevel(self, toplevel):
-		pass
+		if self.bordered is toplevel:
+			self.active = False
+			self.update_border()
+	
+	def update_border(self):
+		"""
+		Keep the border (a chrome rect drawn by the compositor above the desktop window, below the toplevels) around the last activated toplevel.
+		Only properties that changed are sent, so focus changes do not repaint the desktop window.
+		"""
+		
+		toplevel = self.bordered
+		if toplevel is None or toplevel.rect is None:
+			state = None
+		else:
+			x, y, width, height = toplevel.rect
+			w = self.border_width
+			state = (x - w, y - w), (width + 2 * w, height + 2 * w), (self.border_colors[self.active],)
+		
+		previous, self.border_state = self.border_state, state
+		if state == previous:
+			return
+		if state is None:
+			self.manager.chrome('show', self.border, 0)
+			return
+		
+		for op, args, previous_args in zip(['move', 'resize', 'color'], state, previous or [None] * len(state)):
+			if args != previous_args:
+				self.manager.chrome(op, self.border, *args)
+		if previous is None:
+			self.manager.chrome('show', self.border, 1)
+	
+	def next_toplevel(self):
+		children = self.toplevel_stack.get_children()
+		if not children:
+			return
+		try:
+			index = children.index(self.toplevel_stack.get_visible_child())
+		except ValueError:
+			index = -1
+		self.activate_toplevel(children[(index + 1) % len(children)])
 
 
 class WaylandSurface:
@@ -88,16 +172,38 @@ class Toplevel(Gtk.Widget, WaylandSurface):
 		self.set_has_window(False)
 		self.set_can_focus(True)
 		WaylandSurface.__init__(self, identifier)
+		self.title = ''
+		self.app_id = ''
+		self.rect = None
+		self.connect('size-allocate', lambda widget, rect: self.wayland_place(rect.x, rect.y, rect.width, rect.height))
+	
+	def wayland_set_title(self, title=''):
+		self.title = unquote(title)
+		if hasattr(self, 'desktop'):
+			self.desktop.toplevel_stack.child_set_property(self, 'title', self.title)
+	
+	def wayland_set_app_id(self, app_id=''):
+		self.app_id = unquote(app_id)
+	
+	def wayland_launched(self, pid, latency_ms):
+		print("launched", pid, "first map after", latency_ms, "ms", file=stderr)
 	
 	def wayland_activate(self):
 		self.desktop.activate_toplevel(self)
 		print("toplevel activate", file=stderr)
-		self.grab_focus()
+		if self.get_parent() is not None: # not stacked in compositor layout
+			self.grab_focus()
 	
 	def wayland_deactivate(self):
 		self.desktop.deactivate_toplevel(self)
 		print("toplevel deactivate", file=stderr)
 	
+	def wayland_place(self, x, y, width, height):
+		"Window was placed by the compositor (layout or a drag) or by the stack, including decoration."
+		self.rect = int(x), int(y), int(width), int(height)
+		if hasattr(self, 'desktop') and self.desktop.bordered is self:
+			self.desktop.update_border()
+	
 	def wayland_map(self):
 		self.show()
 	
@@ -115,20 +221,98 @@ class Popup(Gtk.Widget, WaylandSurface):
 		self.set_has_window(False)
 		#self.set_focusable(True)
 		WaylandSurface.__init__(self, identifier)
+		self.geometry = None
+	
+	def wayland_place(self, x, y, width, height):
+		"Popup was configured by the compositor; geometry is relative to the parent surface."
+		self.geometry = int(x), int(y), int(width), int(height)
+	
+	def wayland_reposition(self, x, y, width, height):
+		self.wayland_place(x, y, width, height)
 
 
 class Manager:
+	"Keybindings are matched by the compositor; action `quit` is handled there, others call `keybinding_<action>`."
+	
+	keybindings = {
+		'Alt+Tab': 'next_toplevel',
+		'Alt+Return': 'launch_hello',
+		'Ctrl+Alt+BackSpace': 'quit'
+	}
+	
 	def __init__(self, translation):
 		self.translation = translation
 		self.outputs = {}
 		self.toplevels = {}
 		self.popups = {}
+		self.layout = None
+		self.layout_sizes = {}
+	
+	def keybinding(self, action):
+		try:
+			method = getattr(self, 'keybinding_' + action)
+		except AttributeError:
+			print("no keybinding:", action, file=stderr)
+		else:
+			method()
+	
+	def launch(self, *argv):
+		"Ask the compositor to start an application; Python Gtk apps are forked from a pre-warmed zygote."
+		message_out('launch', *map(quote, argv))
 	
-	def new_output(self, id_):
-		self.outputs[id_] = Desktop(self.translation)
+	def chrome(self, op, name, *args):
+		"Create or update a compositor-drawn rect or tree (`Chrome` in the compositor), i.e. `chrome('color', 'focus', '#3080ffff')`."
+		message_out('chrome', op, name, *map(str, args))
+	
+	def set_wallpaper(self, path=None):
+		"Let the compositor draw the wallpaper below the desktop window, pre-scaled for every output. None removes it."
+		message_out('wallpaper', *([quote(path)] if path is not None else []))
+	
+	def set_layout(self, path, root_id, slot_id):
+		"Let the compositor lay out toplevels in the container `slot_id` of the Glade file, i.e. `set_layout('tiling.glade', 'desktop_window', 'tiling_box')`."
+		self.layout = path
+		self.layout_sizes.clear()
+		message_out('layout', quote(path), root_id, slot_id)
+	
+	def track_layout_size(self, widget_id, widget):
+		"Report allocations of the widget (i.e. the menu bar) to the compositor layout, where its id is `widget_id`, so that windows are kept out of it."
+		def allocated(widget, allocation):
+			size = allocation.width, allocation.height
+			if self.layout_sizes.get(widget_id) != size:
+				self.layout_sizes[widget_id] = size
+				message_out('layout_size', widget_id, *size)
+		widget.connect('size-allocate', allocated)
+	
+	def keybinding_launch_hello(self):
+		self.launch('./hello.py', 'hello')
+	
+	def keybinding_next_toplevel(self):
+		if self.outputs:
+			desktop = list(self.outputs.values())[0]
+			desktop.next_toplevel()
+	
+	def new_output(self, id_, *modes):
+		first = not self.outputs
+		self.outputs[id_] = Desktop(self.translation, self, 'border_' + id_)
+		self.outputs[id_].modes = list(modes)
+		if first and self.layout is not None: # the compositor keeps windows out of these widgets on the first output only
+			bars = self.outputs[id_].add_tiling_bars(self.translation)
+			self.track_layout_size('tiling_menubar', bars.tiling_menubar)
+			self.track_layout_size('tiling_panel', bars.tiling_panel)
 		self.outputs[id_].window_main.show_all()
 	
+	def output_change(self, id_, x, y, width, height, scale, transform):
+		"Output was configured; the compositor resizes the desktop window itself."
+		if id_ in self.outputs:
+			self.outputs[id_].geometry = int(x), int(y), int(width), int(height), float(scale), int(transform)
+	
+	def set_output_mode(self, id_, mode):
+		"Select one of the modes (`<width>x<height>@<refresh mHz>`) announced for the output."
+		size, refresh = mode.split('@')
+		message_out('output_mode', id_, *size.split('x'), refresh)
+	
 	def output_destroy(self, id_):
+		self.chrome('destroy', self.outputs[id_].border)
 		self.outputs[id_].window_main.hide()
 		self.outputs[id_].window_main.close()
 		#del self.outputs[id_] # FIXME: remove output after all surfaces have been removed
@@ -136,7 +320,7 @@ class Manager:
 	def new_toplevel(self, id_):
 		toplevel = self.toplevels[id_] = Toplevel(id_)
 		desktop = list(self.outputs.values())[0]
-		desktop.add_toplevel(toplevel)
+		desktop.add_toplevel(toplevel, stacked=self.layout is None)
 	
 	def toplevel_destroy(self, id_):
 		if id_ in self.toplevels:
@@ -171,8 +355,11 @@ if __name__ == '__main__':
 	def message_in(msg):
 		print("received:", msg, file=stderr)
 		match msg.split():
-			case [msg_id, 'new_output', 'OUTPUT', output_id]:
-				manager.new_output(output_id)
+			case [msg_id, 'new_output', 'OUTPUT', output_id, *modes]:
+				manager.new_output(output_id, *modes)
+				message_out('@', msg_id)
+			case [msg_id, 'output_change', 'OUTPUT', output_id, *config]:
+				manager.output_change(output_id, *config)
 				message_out('@', msg_id)
 			case [msg_id, 'output_destroy', 'OUTPUT', output_id]:
 				manager.output_destroy(output_id)
@@ -184,14 +371,14 @@ if __name__ == '__main__':
 			case [msg_id, 'surface_destroy', 'TOPLEVEL', surface_id]:
 				manager.toplevel_destroy(surface_id)
 				message_out('@', msg_id)
-			case [msg_id, method_name, 'TOPLEVEL', surface_id]:
+			case [msg_id, method_name, 'TOPLEVEL', surface_id, *args]:
 				if surface_id in manager.toplevels:
 					try:
 						method = getattr(manager.toplevels[surface_id], 'wayland_' + method_name)
 					except AttributeError:
 						print("no method:", 'wayland_' + method_name, file=stderr)
 					else:
-						method()
+						method(*args)
 				message_out('@', msg_id)
 			
 			case [msg_id, 'new_surface', 'POPUP', surface_id]:
@@ -200,14 +387,21 @@ if __name__ == '__main__':
 			case [msg_id, 'surface_destroy', 'POPUP', surface_id]:
 				manager.popup_destroy(surface_id)
 				message_out('@', msg_id)
-			case [msg_id, method_name, 'POPUP', surface_id]:
+			case [msg_id, method_name, 'POPUP', surface_id, *args]:
 				if surface_id in manager.popups:
 					try:
 						method = getattr(manager.popups[surface_id], 'wayland_' + method_name)
 					except AttributeError:
 						print("no method:", 'wayland_' + method_name, file=stderr)
 					else:
-						method()
+						method(*args)
+				message_out('@', msg_id)
+			
+			case [msg_id, 'keybinding', 'SEAT', _, action]:
+				manager.keybinding(action)
+				message_out('@', msg_id)
+			case [msg_id, 'launch_failed', 'SEAT', _, command, error]:
+				print("launch failed:", unquote(command), unquote(error), file=stderr)
 				message_out('@', msg_id)
 			
 			case [msg_id, 'quit', _, _]:
@@ -223,14 +417,22 @@ if __name__ == '__main__':
 		message_id += 1
 		stdout.flush()
 	
+	pending = bytearray() # partial line, completed by the next read
+	
 	def data_in(fd, condition):
 		if condition & GLib.IO_IN:
-			data = read(fd, 256).decode('utf-8')
-			assert(data[-1] == "\n")
+			data = read(fd, 4096)
+			if not data:
+				mainloop.quit()
+				return False
 			
-			for ss in data.split("\n"):
+			pending.extend(data)
+			*lines, rest = pending.split(b"\n")
+			pending[:] = rest
+			
+			for ss in lines:
 				if ss:
-					message_in(ss)
+					message_in(ss.decode('utf-8'))
 		
 		elif condition & GLib.IO_HUP:
 			mainloop.quit()
@@ -239,6 +441,10 @@ if __name__ == '__main__':
 	
 	GLib.io_add_watch(0, GLib.IO_IN | GLib.IO_HUP, data_in)
 	
+	message_out('bind', *[f"{_combination}:{_action}" for _combination, _action in manager.keybindings.items()])
+	manager.set_wallpaper('staring-cat.jpg')
+	manager.set_layout('tiling.glade', 'desktop_window', 'tiling_box')
+	
 	mainloop = GLib.MainLoop()
 	
 	try:
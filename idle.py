@@ -0,0 +1,120 @@
+from enum import Enum
+
+from native import output_schedule_frame
+
+
+class PowerMode(Enum):
+	ACTIVE = 0
+	THROTTLED = 1
+	OFF = 2
+
+
+class IdlePolicy:
+	"""
+	Step outputs down when the seat is idle. After `throttle_timeout` seconds without input, frames are rendered
+	(and frame-done sent to clients) only `throttle_rate` times per second; after `off_timeout` seconds outputs are disabled.
+	The first input event restores full refresh rate. While any idle inhibitor is active (i.e. video player), nothing is throttled.
+	Timeouts of 0 disable the corresponding step; if `off_timeout` is not longer than `throttle_timeout`, outputs go straight off.
+	"""
+	
+	def __init__(self, server, throttle_timeout:float=60, off_timeout:float=300, throttle_rate:float=5):
+		self.server = server
+		self.log = server.log
+		self.throttle_timeout = throttle_timeout
+		self.off_timeout = off_timeout
+		self.throttle_rate = throttle_rate
+		
+		self.mode = PowerMode.ACTIVE
+		self.inhibitors = 0
+		self.frames_due = set()
+		
+		self.idle_timer = server.event_loop.add_timer(self.__idle_timeout)
+		self.frame_timer = server.event_loop.add_timer(self.__frame_timeout)
+		self.__arm(self.__first_timeout())
+	
+	def close(self):
+		self.idle_timer.remove()
+		self.frame_timer.remove()
+	
+	def __arm(self, timeout:float):
+		self.idle_timer.timer_update(int(timeout * 1000))
+	
+	def __first_timeout(self) -> float:
+		return min([_timeout for _timeout in (self.throttle_timeout, self.off_timeout) if _timeout] or [0])
+	
+	def activity(self):
+		"Input event happened; restore full power and restart the idle timeout."
+		
+		self.server.idle_notify.notify_activity(self.server.seat)
+		if self.mode != PowerMode.ACTIVE:
+			self.set_mode(PowerMode.ACTIVE)
+		self.__arm(self.__first_timeout())
+	
+	def inhibit(self, inhibited:bool):
+		"Idle inhibitor was created or destroyed."
+		
+		self.inhibitors += 1 if inhibited else -1
+		self.server.idle_notify.set_inhibited(self.inhibitors > 0)
+		if self.inhibitors > 0:
+			if self.mode != PowerMode.ACTIVE:
+				self.set_mode(PowerMode.ACTIVE)
+		else:
+			self.__arm(self.__first_timeout())
+	
+	def __idle_timeout(self, data):
+		if self.inhibitors > 0:
+			return 0
+		
+		if self.mode == PowerMode.ACTIVE and self.throttle_timeout and not (self.off_timeout and self.off_timeout <= self.throttle_timeout):
+			self.set_mode(PowerMode.THROTTLED)
+			if self.off_timeout:
+				self.__arm(self.off_timeout - self.throttle_timeout)
+		elif self.off_timeout:
+			self.set_mode(PowerMode.OFF)
+		return 0
+	
+	def __frame_timeout(self, data):
+		"Throttled mode tick; let every output render one frame."
+		
+		if self.mode != PowerMode.THROTTLED:
+			return 0
+		
+		for id_, output in self.server.outputs.items():
+			self.frames_due.add(id_)
+			output_schedule_frame(output)
+		self.frame_timer.timer_update(int(1000 / self.throttle_rate))
+		return 0
+	
+	def set_mode(self, mode:PowerMode):
+		self.log.info(f"power mode {mode.name}")
+		previous, self.mode = self.mode, mode
+		
+		if previous == PowerMode.OFF:
+			for output in self.server.outputs.values():
+				output.enable()
+				output.commit()
+		
+		if mode == PowerMode.THROTTLED:
+			self.frame_timer.timer_update(int(1000 / self.throttle_rate))
+		else:
+			self.frame_timer.timer_update(0)
+			self.frames_due.clear()
+		
+		if mode == PowerMode.OFF:
+			for output in self.server.outputs.values():
+				output.enable(enable=False)
+				output.commit()
+		elif mode == PowerMode.ACTIVE:
+			for output in self.server.outputs.values():
+				output_schedule_frame(output)
+	
+	def frame_allowed(self, output) -> bool:
+		"Whether the output should render now. Skipped frames also withhold frame-done, so clients slow down too."
+		
+		if self.mode == PowerMode.ACTIVE:
+			return True
+		elif self.mode == PowerMode.THROTTLED and id(output) in self.frames_due:
+			self.frames_due.remove(id(output))
+			return True
+		else:
+			return False
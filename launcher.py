@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+
+import os
+import sys
+from time import monotonic
+from urllib.parse import quote, unquote
+
+
+class Launcher:
+	"""
+	Start applications on behalf of the manager. Python scripts are forked from a zygote process that has already imported
+	Python, GObject introspection and Gtk, so they skip interpreter and typelib startup. Other commands are started with `Popen`.
+	Launch time is remembered per pid for `expire_after` seconds, so that the latency to the first mapped window can be reported.
+	If an application can not be started, `failed(argv, message)` is called. If the zygote exits, launches it did not
+	report are started with `Popen`, as are all later ones.
+	"""
+	
+	expire_after = 60
+	
+	def __init__(self, log, loop, environ:dict, failed=None):
+		from subprocess import Popen, PIPE
+		
+		self.log = log
+		self.environ = environ
+		self.failed = failed
+		self.launched = {} # pid -> launch time
+		self.requested = {} # launch id -> (launch time, argv), until the zygote reports pid
+		self.processes = []
+		self.serial = 0
+		
+		self.zygote = Popen([sys.executable, __file__, '--zygote'], stdin=PIPE, stdout=PIPE, env=environ)
+		self.reader = loop.create_task(self.zygote_reader())
+	
+	def close(self):
+		"Stop the zygote. The reader task is cancelled; the caller runs the loop until it finishes."
+		
+		self.reader.cancel()
+		if self.zygote is not None:
+			self.zygote.stdin.close()
+			self.zygote.wait()
+			self.zygote = None
+	
+	@staticmethod
+	def is_python(path:str) -> bool:
+		if path.endswith('.py'):
+			return True
+		try:
+			with open(path, 'rb') as script:
+				first = script.readline()
+		except OSError:
+			return False
+		return first.startswith(b'#!') and b'python' in first
+	
+	def launch(self, argv:list[str]):
+		"Start application. Latency to its first window will be available from `mapped()`."
+		
+		self.processes = [_process for _process in self.processes if _process.poll() is None]
+		now = monotonic()
+		self.launched = {_pid: _time for (_pid, _time) in self.launched.items() if now - _time < self.expire_after} # i.e. command line tools never map
+		
+		if self.zygote is not None and self.is_python(argv[0]):
+			launch_id = self.serial
+			self.serial += 1
+			self.requested[launch_id] = now, argv
+			try:
+				self.zygote.stdin.write((" ".join([str(launch_id), *map(quote, argv)]) + "\n").encode('utf-8'))
+				self.zygote.stdin.flush()
+			except BrokenPipeError:
+				pass # zygote exited; the request is started by `zygote_exited`
+		else:
+			self.spawn(argv, now)
+	
+	def spawn(self, argv:list[str], launch_time:float):
+		from subprocess import Popen
+		try:
+			process = Popen(argv, env=self.environ)
+		except OSError as error:
+			self.launch_failed(argv, str(error))
+			return
+		self.processes.append(process)
+		self.launched[process.pid] = launch_time
+	
+	def launch_failed(self, argv:list[str], message:str):
+		self.log.error(f"launch {argv[0]}: {message}")
+		if self.failed is not None:
+			self.failed(argv, message)
+	
+	async def zygote_reader(self):
+		"Read zygote replies without blocking the event loop, until the zygote exits."
+		
+		from aioloop import read_lines
+		async for line in read_lines(self.zygote.stdout.fileno()):
+			self.zygote_reply(line.decode('utf-8'))
+		self.zygote_exited()
+	
+	def zygote_reply(self, msg):
+		match msg.split():
+			case [launch_id, pid]:
+				self.launched[int(pid)] = self.requested.pop(int(launch_id))[0]
+			case [launch_id, 'error', *error]:
+				launch_time, argv = self.requested.pop(int(launch_id))
+				self.launch_failed(argv, unquote(' '.join(error)))
+			case []:
+				pass
+			case default:
+				self.log.warning(f"zygote: {default}")
+	
+	def zygote_exited(self):
+		"Drop the zygote and start the launches it did not report with `Popen`."
+		
+		self.log.warning(f"zygote exited with {self.zygote.wait()}, launching without it")
+		try:
+			self.zygote.stdin.close()
+		except BrokenPipeError:
+			pass
+		self.zygote = None
+		requested, self.requested = self.requested, {}
+		for launch_time, argv in requested.values():
+			self.spawn(argv, launch_time)
+	
+	def mapped(self, pid:int) -> float | None:
+		"Client with the provided pid mapped a window. Return seconds since its launch if it is the first window."
+		
+		try:
+			return monotonic() - self.launched.pop(pid)
+		except KeyError:
+			return None
+
+
+def zygote():
+	"""
+	Import Gtk without connecting to the display, then fork a new process for every launch request read from stdin.
+	Request format: `<launch id> <quoted argv...>`. Reply: `<launch id> <pid>`.
+	"""
+	
+	import signal
+	
+	hidden = {_key: os.environ.pop(_key) for _key in ['WAYLAND_DISPLAY', 'DISPLAY'] if _key in os.environ}
+	os.environ['WAYLAND_DISPLAY'] = 'gwayco-zygote-no-display' # make Gtk initialization fail instead of falling back to a default socket
+	
+	import gi
+	gi.require_version('Gtk', '3.0')
+	from gi.repository import Gtk # loads the typelibs it depends on too (GLib, GObject, Gio, Gdk), once for all children
+	
+	del os.environ['WAYLAND_DISPLAY']
+	os.environ.update(hidden)
+	
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN) # children are reaped automatically
+	
+	for line in sys.stdin:
+		launch_id, *argv = line.split()
+		argv = [unquote(_arg) for _arg in argv]
+		
+		try:
+			pid = os.fork()
+		except OSError as error:
+			print(launch_id, 'error', quote(str(error)), flush=True)
+			continue
+		
+		if pid == 0:
+			try:
+				os.setsid()
+				signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+				sys.stdin.close()
+				os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+				os.dup2(2, 1) # stdout is the pipe to the compositor
+				sys.stdout = sys.stderr
+				sys.argv = argv
+				Gtk.init_check(argv)
+				
+				import runpy
+				runpy.run_path(argv[0], run_name='__main__')
+			except SystemExit as error:
+				os._exit(0 if error.code is None else error.code if isinstance(error.code, int) else 1)
+			except BaseException:
+				import traceback
+				traceback.print_exc()
+				os._exit(1)
+			os._exit(0)
+		
+		print(launch_id, pid, flush=True)
+
+
+if __name__ == '__main__':
+	if sys.argv[1:] == ['--zygote']:
+		zygote()
+	else:
+		print(f"Usage: {sys.argv[0]} --zygote", file=sys.stderr)
+		exit(1)
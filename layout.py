@@ -0,0 +1,352 @@
+from xml.etree import ElementTree
+
+
+class LayoutNode:
+	"""
+	Node of a compiled layout. Mirrors the geometry related properties of a Gtk widget: size request, margins,
+	alignment and expand flags. Natural sizes would require running Gtk, so they are reported by the manager
+	(see `Layout.set_size`); windows use the hint set by the compositor instead.
+	"""
+	
+	def __init__(self, id_=None, properties={}):
+		self.id = id_
+		self.children = [] # pairs (node, packing)
+		self.border = int(properties.get('border-width', 0))
+		self.margin = [int(properties.get('margin-' + _side, properties.get('margin', 0))) for _side in ['start', 'top', 'end', 'bottom']]
+		self.halign = properties.get('halign', 'fill')
+		self.valign = properties.get('valign', 'fill')
+		self.hexpand = _bool(properties.get('hexpand', 'False'))
+		self.vexpand = _bool(properties.get('vexpand', 'False'))
+		self.size_request = [max(0, int(properties.get('width-request', 0))), max(0, int(properties.get('height-request', 0)))]
+		self.natural = [0, 0]
+	
+	def __repr__(self):
+		return f"{self.__class__.__name__}({self.id!r}, {[_child for _child, _packing in self.children]!r})"
+	
+	def add(self, node, packing={}):
+		self.children.append((node, packing))
+	
+	def find(self, id_):
+		if self.id == id_:
+			return self
+		for child, packing in self.children:
+			node = child.find(id_)
+			if node is not None:
+				return node
+		return None
+	
+	def expands(self, axis:int) -> bool:
+		"Gtk propagates expand flags from children to containers."
+		return (self.hexpand, self.vexpand)[axis] or any(_child.expands(axis) for _child, _packing in self.children)
+	
+	def minimum(self, axis:int) -> int:
+		"Minimum size along axis (0 = horizontal, 1 = vertical) including margins."
+		return max(self.size_request[axis], self.natural[axis], self.content_minimum(axis) + 2 * self.border) + self.margin[axis] + self.margin[axis + 2]
+	
+	def content_minimum(self, axis:int) -> int:
+		return max([_child.minimum(axis) for _child, _packing in self.children] or [0])
+	
+	def allocate(self, x:int, y:int, width:int, height:int, result:dict):
+		"Allocate the rectangle to the node (margins and alignment applied here) and its descendants. Window rectangles are stored in `result`."
+		
+		x += self.margin[0]
+		y += self.margin[1]
+		width = max(0, width - self.margin[0] - self.margin[2])
+		height = max(0, height - self.margin[1] - self.margin[3])
+		
+		x, width = _align(self.halign, x, width, self.minimum(0) - self.margin[0] - self.margin[2])
+		y, height = _align(self.valign, y, height, self.minimum(1) - self.margin[1] - self.margin[3])
+		
+		self.allocation = x, y, width, height
+		b = self.border
+		self.allocate_content(x + b, y + b, max(0, width - 2 * b), max(0, height - 2 * b), result)
+	
+	def allocate_content(self, x:int, y:int, width:int, height:int, result:dict):
+		for child, packing in self.children:
+			child.allocate(x, y, width, height, result)
+
+
+class LeafLayout(LayoutNode):
+	"Widget that is not a container, or whose children do not matter for the layout (menu bar, label, image)."
+
+
+class WindowLayout(LayoutNode):
+	"Slot occupied by a client window; `hint` is the minimum size the window asked for."
+	
+	def __init__(self, key, hint=(0, 0)):
+		super().__init__(None, {'hexpand':'True', 'vexpand':'True'})
+		self.key = key
+		self.size_request = list(hint)
+	
+	def __repr__(self):
+		return f"{self.__class__.__name__}({self.key!r})"
+	
+	def allocate_content(self, x:int, y:int, width:int, height:int, result:dict):
+		result[self.key] = x, y, width, height
+
+
+class BinLayout(LayoutNode):
+	"Container with children on top of each other, all getting the full allocation (GtkFrame, GtkStack and similar)."
+
+
+class OverlayLayout(LayoutNode):
+	"GtkOverlay: main child gets the full allocation, overlay children are placed by their own alignment."
+
+
+class BoxLayout(LayoutNode):
+	"GtkBox: children in a row or a column, with `expand`, `fill`, `padding` and `pack-type` packing properties."
+	
+	def __init__(self, id_=None, properties={}):
+		super().__init__(id_, properties)
+		self.axis = 1 if properties.get('orientation', 'horizontal') == 'vertical' else 0
+		self.spacing = int(properties.get('spacing', 0))
+		self.homogeneous = _bool(properties.get('homogeneous', 'False'))
+	
+	def add(self, node, packing={}):
+		packing = {'expand':_bool(packing.get('expand', 'False')) or node.expands(self.axis), 'fill':_bool(packing.get('fill', 'True')), 'padding':int(packing.get('padding', 0)), 'pack-type':packing.get('pack-type', 'start'), 'position':int(packing.get('position', len(self.children)))}
+		self.children.append((node, packing))
+		self.children.sort(key=lambda _child: _child[1]['position'])
+	
+	def expands(self, axis:int) -> bool:
+		return (self.hexpand, self.vexpand)[axis] or any(_packing['expand'] if axis == self.axis else _child.expands(axis) for _child, _packing in self.children)
+	
+	def content_minimum(self, axis:int) -> int:
+		if not self.children:
+			return 0
+		if axis != self.axis:
+			return max(_child.minimum(axis) for _child, _packing in self.children)
+		sizes = [_child.minimum(axis) + 2 * _packing['padding'] for _child, _packing in self.children]
+		if self.homogeneous:
+			sizes = [max(sizes)] * len(sizes)
+		return sum(sizes) + self.spacing * (len(sizes) - 1)
+	
+	def allocate_content(self, x:int, y:int, width:int, height:int, result:dict):
+		if not self.children:
+			return
+		
+		origin = (x, y)[self.axis]
+		size = (width, height)[self.axis]
+		available = size - self.spacing * (len(self.children) - 1)
+		
+		if self.homogeneous:
+			sizes = _distribute(available, [0] * len(self.children), [True] * len(self.children))
+		else:
+			minimums = [_child.minimum(self.axis) + 2 * _packing['padding'] for _child, _packing in self.children]
+			sizes = _distribute(available, minimums, [_packing['expand'] for _child, _packing in self.children])
+		
+		start = origin
+		end = origin + size
+		for (child, packing), child_size in zip(self.children, sizes):
+			if packing['pack-type'] == 'end':
+				end -= child_size
+				position = end
+				end -= self.spacing
+			else:
+				position = start
+				start += child_size + self.spacing
+			
+			position += packing['padding']
+			child_size = max(0, child_size - 2 * packing['padding'])
+			if not packing['fill']:
+				minimum = child.minimum(self.axis)
+				position += (child_size - minimum) // 2
+				child_size = min(child_size, minimum)
+			
+			if self.axis == 0:
+				child.allocate(position, y, child_size, height, result)
+			else:
+				child.allocate(x, position, width, child_size, result)
+
+
+class GridLayout(LayoutNode):
+	"GtkGrid: children attached to cells with `left-attach`, `top-attach`, `width` and `height` packing properties."
+	
+	def __init__(self, id_=None, properties={}):
+		super().__init__(id_, properties)
+		self.spacing = [int(properties.get('column-spacing', 0)), int(properties.get('row-spacing', 0))]
+		self.homogeneous = [_bool(properties.get('column-homogeneous', 'False')), _bool(properties.get('row-homogeneous', 'False'))]
+	
+	def add(self, node, packing={}):
+		if 'left-attach' not in packing: # windows are added in a new column
+			packing = {'left-attach':sum(_packing['width'] for _child, _packing in self.children if _packing['top-attach'] == 0), 'top-attach':0}
+		packing = {'left-attach':int(packing.get('left-attach', 0)), 'top-attach':int(packing.get('top-attach', 0)), 'width':int(packing.get('width', 1)), 'height':int(packing.get('height', 1))}
+		self.children.append((node, packing))
+	
+	def __lines(self, axis:int):
+		"Minimum sizes and expand flags of columns (axis 0) or rows (axis 1)."
+		
+		attach, span = ('left-attach', 'width') if axis == 0 else ('top-attach', 'height')
+		count = max([_packing[attach] + _packing[span] for _child, _packing in self.children] or [0])
+		offset = min([_packing[attach] for _child, _packing in self.children] or [0])
+		minimums = [0] * (count - offset)
+		expand = [False] * (count - offset)
+		for child, packing in self.children:
+			first = packing[attach] - offset
+			share = (child.minimum(axis) - self.spacing[axis] * (packing[span] - 1)) // packing[span]
+			for n in range(first, first + packing[span]):
+				minimums[n] = max(minimums[n], share)
+				expand[n] = expand[n] or child.expands(axis)
+		if self.homogeneous[axis]:
+			minimums = [max(minimums or [0])] * len(minimums)
+			expand = [True] * len(expand)
+		return offset, minimums, expand
+	
+	def content_minimum(self, axis:int) -> int:
+		offset, minimums, expand = self.__lines(axis)
+		return sum(minimums) + self.spacing[axis] * max(0, len(minimums) - 1)
+	
+	def allocate_content(self, x:int, y:int, width:int, height:int, result:dict):
+		cells = []
+		for axis, origin, size in [(0, x, width), (1, y, height)]:
+			offset, minimums, expand = self.__lines(axis)
+			sizes = _distribute(size - self.spacing[axis] * max(0, len(minimums) - 1), minimums, expand)
+			positions = []
+			for line_size in sizes:
+				positions.append(origin)
+				origin += line_size + self.spacing[axis]
+			cells.append((offset, positions, sizes))
+		
+		for child, packing in self.children:
+			rect = []
+			for (offset, positions, sizes), attach, span in zip(cells, ['left-attach', 'top-attach'], ['width', 'height']):
+				first = packing[attach] - offset
+				last = first + packing[span] - 1
+				rect.append((positions[first], positions[last] + sizes[last] - positions[first]))
+			child.allocate(rect[0][0], rect[1][0], rect[0][1], rect[1][1], result)
+
+
+class Layout:
+	"""
+	Layout tree compiled from a Glade file. Client windows are added to container slots (by widget id)
+	and the tree is evaluated natively by the compositor, without a Gtk allocation pass in the manager.
+	"""
+	
+	def __init__(self, root:LayoutNode):
+		self.root = root
+		self.windows = {} # key -> (container, node)
+	
+	def add_window(self, container_id:str, key, hint=(0, 0)):
+		container = self.root.find(container_id)
+		if container is None:
+			raise KeyError(f"No container {container_id} in layout")
+		node = WindowLayout(key, hint)
+		container.add(node)
+		self.windows[key] = container, node
+	
+	def remove_window(self, key):
+		container, node = self.windows.pop(key)
+		container.children = [(_child, _packing) for _child, _packing in container.children if _child is not node]
+	
+	def set_hint(self, key, hint) -> bool:
+		"Set the minimum size of the window; return True if it changed."
+		
+		container, node = self.windows[key]
+		changed = node.size_request != list(hint)
+		node.size_request = list(hint)
+		return changed
+	
+	def set_size(self, id_:str, width:int, height:int):
+		"Natural size of a widget, as allocated by Gtk in the manager (i.e. a menu bar). Windows are kept out of it."
+		
+		node = self.root.find(id_)
+		if node is None:
+			raise KeyError(f"No widget {id_} in layout")
+		node.natural = [max(0, width), max(0, height)]
+	
+	def allocate(self, x:int, y:int, width:int, height:int) -> dict:
+		"Return rectangles `(x, y, width, height)` of all windows, by key."
+		
+		result = {}
+		self.root.allocate(x, y, width, height, result)
+		return result
+
+
+_containers = {
+	'GtkBox': BoxLayout,
+	'GtkButtonBox': BoxLayout,
+	'GtkGrid': GridLayout,
+	'GtkOverlay': OverlayLayout,
+	'GtkStack': BinLayout,
+	'GtkNotebook': BinLayout,
+	'GtkFrame': BinLayout,
+	'GtkAspectFrame': BinLayout,
+	'GtkAlignment': BinLayout,
+	'GtkEventBox': BinLayout,
+	'GtkScrolledWindow': BinLayout,
+	'GtkViewport': BinLayout,
+	'GtkRevealer': BinLayout
+}
+
+
+def _bool(value:str) -> bool:
+	return value.lower() in ('true', 'yes', '1')
+
+
+def _align(align:str, origin:int, size:int, minimum:int) -> tuple[int, int]:
+	if align in ('fill', 'baseline') or minimum >= size:
+		return origin, size
+	elif align == 'start':
+		return origin, minimum
+	elif align == 'end':
+		return origin + size - minimum, minimum
+	else:
+		return origin + (size - minimum) // 2, minimum
+
+
+def _distribute(size:int, minimums:list[int], expand:list[bool]) -> list[int]:
+	"Give every line its minimum, then share the rest equally between expanding lines. Rounding remainder goes to the first lines."
+	
+	if not minimums:
+		return []
+	extra = size - sum(minimums)
+	if extra < 0: # not enough space; shrink proportionally
+		total = sum(minimums) or 1
+		return [_minimum * size // total for _minimum in minimums]
+	count = sum(expand)
+	if not count:
+		return list(minimums)
+	sizes = []
+	remainder = extra % count
+	for minimum, expanding in zip(minimums, expand):
+		if expanding:
+			sizes.append(minimum + extra // count + (1 if remainder else 0))
+			remainder = max(0, remainder - 1)
+		else:
+			sizes.append(minimum)
+	return sizes
+
+
+def _compile(element) -> LayoutNode:
+	properties = {_property.get('name'): _property.text or '' for _property in element.findall('property')}
+	class_ = element.get('class')
+	
+	if class_ in ('GtkWindow', 'GtkOffscreenWindow'):
+		class_ = 'GtkFrame'
+	
+	if class_ not in _containers:
+		return LeafLayout(element.get('id'), properties)
+	
+	node = _containers[class_](element.get('id'), properties)
+	for child in element.findall('child'):
+		if child.get('type') in ('label', 'titlebar', 'tab'):
+			continue
+		obj = child.find('object')
+		if obj is None: # placeholder
+			continue
+		if _bool({_property.get('name'): _property.text or '' for _property in obj.findall('property')}.get('visible', 'False')) or obj.get('class') in ('GtkWindow', 'GtkOffscreenWindow'):
+			packing = child.find('packing')
+			node.add(_compile(obj), {_property.get('name'): _property.text or '' for _property in packing.findall('property')} if packing is not None else {})
+	return node
+
+
+def compile_glade(path:str, root_id:str=None) -> Layout:
+	"Compile the container structure of a Glade file, starting from the object `root_id` (or the first toplevel object)."
+	
+	interface = ElementTree.parse(path).getroot()
+	if root_id is None:
+		element = interface.find('object')
+	else:
+		element = next((_object for _object in interface.iter('object') if _object.get('id') == root_id), None)
+	if element is None:
+		raise KeyError(f"No object {root_id} in {path}")
+	return Layout(_compile(element))
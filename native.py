@@ -0,0 +1,63 @@
+"""
+wlroots functions that pywlroots does not declare in its cdef, called through ctypes.
+The library is the one already loaded by the pywlroots extension (bundled or system), found in the process memory map;
+`CDLL` of the same path returns the same handle, so objects are shared with `wlroots.lib`.
+"""
+
+
+import ctypes
+import os
+
+import cffi
+from wlroots import ffi
+
+
+def _load() -> ctypes.CDLL:
+	with open('/proc/self/maps') as maps:
+		for line in maps:
+			path = line.split()[-1]
+			if os.path.basename(path).startswith('libwlroots'):
+				return ctypes.CDLL(path)
+	raise ImportError("libwlroots is not loaded")
+
+
+_wlroots = _load()
+_wlroots.wlr_output_schedule_frame.argtypes = [ctypes.c_void_p]
+_wlroots.wlr_output_schedule_frame.restype = None
+_wlroots.wlr_renderer_get_render_formats.argtypes = [ctypes.c_void_p]
+_wlroots.wlr_renderer_get_render_formats.restype = ctypes.c_void_p
+
+
+def _address(ptr) -> int:
+	return int(ffi.cast('uintptr_t', ptr))
+
+
+# structs that pywlroots does not declare, laid out by cffi for this platform
+_ffi = cffi.FFI()
+_ffi.cdef("""
+	struct timespec;
+	struct wlr_output_event_commit {
+		void *output;
+		uint32_t committed;
+		struct timespec *when;
+		void *buffer;
+	};
+""")
+
+
+def output_schedule_frame(output):
+	"Ask the output for a `frame` event, even if nothing has been damaged."
+	_wlroots.wlr_output_schedule_frame(_address(output._ptr))
+
+
+def output_event_commit_buffer(event):
+	"Buffer of the output `commit` event (`struct wlr_output_event_commit`, wlroots 0.16) as `struct wlr_buffer *`, NULL if no buffer was committed."
+	commit = _ffi.cast('struct wlr_output_event_commit *', _address(event))
+	return ffi.cast('struct wlr_buffer *', int(_ffi.cast('uintptr_t', commit.buffer)))
+
+
+def renderer_render_formats(renderer):
+	"Formats the renderer can render to, as `struct wlr_drm_format_set *` (NULL if unknown)."
+	address = _wlroots.wlr_renderer_get_render_formats(_address(renderer._ptr))
+	return ffi.cast('struct wlr_drm_format_set *', address or 0)
+
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+
+"""
+Record and replay of the manager protocol.
+
+The compositor records the conversation with the manager when `GWAYCO_RECORD` is set to a file name. Each line of the log is
+`<microseconds since start> <direction> <message>`, where direction `>` is a message sent to the manager (notifications and
+acknowledgements) and `<` is a request received from the manager.
+
+The replay tool runs a manager without the compositor and feeds it the recorded messages, either at the recorded times
+or as fast as possible. A message is not sent before the manager produced all requests that preceded it in the log,
+so the run is deterministic. At the end it reports per-message latency (notification to acknowledgement) and whether
+the requests from the manager are the same as recorded.
+
+Usage: ./replay.py [--fast] <log> <manager command...>
+
+The manager still needs a display for its own windows (i.e. run it under X11 or any Wayland session), but no clients.
+"""
+
+
+import sys
+from itertools import zip_longest
+from time import monotonic, monotonic_ns, sleep
+
+
+class Recorder:
+	"Timestamped log of manager protocol messages."
+	
+	def __init__(self, path:str):
+		self.file = open(path, 'w', encoding='utf-8')
+		self.start = monotonic_ns()
+	
+	def close(self):
+		self.file.close()
+	
+	def record(self, direction:str, line:str):
+		self.file.write(f"{(monotonic_ns() - self.start) // 1000} {direction} {line}\n")
+
+
+class RecordingWriter:
+	"Wrapper of the pipe to the manager that records every line written to it."
+	
+	def __init__(self, stream, recorder:Recorder):
+		self.stream = stream
+		self.recorder = recorder
+	
+	def write(self, data:bytes):
+		for line in data.decode('utf-8').splitlines():
+			self.recorder.record('>', line)
+		return self.stream.write(data)
+	
+	def flush(self):
+		self.stream.flush()
+	
+	def close(self):
+		self.stream.close()
+
+
+def read_log(path:str) -> list[tuple[float, str, str]]:
+	"Load recorded log as a list of `(seconds, direction, message)`."
+	
+	entries = []
+	with open(path, encoding='utf-8') as log:
+		for line in log:
+			timestamp, direction, message = line.rstrip('\n').split(' ', 2)
+			entries.append((int(timestamp) / 1000000, direction, message))
+	return entries
+
+
+class Replay:
+	"Drive a manager process with recorded notifications and collect its requests."
+	
+	def __init__(self, entries:list, command:list[str], fast:bool=False, timeout:float=5):
+		self.entries = entries
+		self.command = command
+		self.fast = fast
+		self.timeout = timeout
+		
+		self.requests = [] # (time, line) received from the manager
+		self.sent = {} # notification serial -> (time, method)
+		self.stalls = 0
+	
+	def run(self):
+		from subprocess import Popen, PIPE, TimeoutExpired
+		from threading import Thread, Condition
+		
+		self.condition = Condition()
+		manager = Popen(self.command, stdin=PIPE, stdout=PIPE)
+		
+		def reader():
+			for line in manager.stdout:
+				with self.condition:
+					self.requests.append((monotonic(), line.decode('utf-8').rstrip('\n')))
+					self.condition.notify()
+		
+		reader_thread = Thread(target=reader, daemon=True)
+		reader_thread.start()
+		
+		start = monotonic()
+		expected = 0 # number of requests recorded so far
+		
+		try:
+			for timestamp, direction, message in self.entries:
+				if direction == '<':
+					expected += 1
+					continue
+				
+				with self.condition:
+					if not self.condition.wait_for(lambda: len(self.requests) >= expected, self.timeout):
+						self.stalls += 1
+				
+				if not self.fast:
+					delay = start + timestamp - monotonic()
+					if delay > 0:
+						sleep(delay)
+				
+				match message.split():
+					case [serial, method, *_] if serial != '@':
+						self.sent[serial] = monotonic(), method
+				
+				manager.stdin.write(message.encode('utf-8') + b"\n")
+				manager.stdin.flush()
+			
+			with self.condition:
+				self.condition.wait_for(lambda: len(self.requests) >= expected, self.timeout)
+		except BrokenPipeError:
+			pass
+		finally:
+			try:
+				manager.stdin.close()
+			except BrokenPipeError:
+				pass
+			try:
+				manager.wait(self.timeout)
+			except TimeoutExpired:
+				manager.terminate()
+				manager.wait()
+			reader_thread.join(self.timeout)
+		
+		self.duration = monotonic() - start
+	
+	def latencies(self) -> dict[str, list[float]]:
+		"Seconds from sending a notification to its acknowledgement `<id> @ <serial>`, per notification method."
+		
+		result = {}
+		for received, line in self.requests:
+			match line.split():
+				case [_, '@', serial] if serial in self.sent:
+					sent, method = self.sent.pop(serial)
+					result.setdefault(method, []).append(received - sent)
+		return result
+	
+	def differences(self) -> list[tuple[int, str | None, str | None]]:
+		"Requests that differ from the recording, as `(index, recorded, replayed)`."
+		
+		recorded = [_message for (_timestamp, _direction, _message) in self.entries if _direction == '<']
+		replayed = [_line for (_time, _line) in self.requests]
+		return [(_n, _recorded, _replayed) for (_n, (_recorded, _replayed)) in enumerate(zip_longest(recorded, replayed)) if _recorded != _replayed]
+	
+	def report(self, file=sys.stdout) -> bool:
+		"Print latency statistics and equivalence of output; return True if the output is the same as recorded."
+		
+		print(f"messages: {sum(1 for _entry in self.entries if _entry[1] == '>')} sent, {len(self.requests)} received in {self.duration:.3f} s", file=file)
+		
+		print(f"{'method':24} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}   (ms)", file=file)
+		for method, values in sorted(self.latencies().items()):
+			values.sort()
+			percentile = lambda p: values[min(len(values) - 1, int(p * len(values)))] * 1000
+			print(f"{method:24} {len(values):7} {sum(values) / len(values) * 1000:9.3f} {percentile(0.5):9.3f} {percentile(0.95):9.3f} {percentile(0.99):9.3f} {values[-1] * 1000:9.3f}", file=file)
+		if self.sent:
+			print(f"not acknowledged: {len(self.sent)}", file=file)
+		if self.stalls:
+			print(f"stalls waiting for manager: {self.stalls}", file=file)
+		
+		differences = self.differences()
+		if differences:
+			print(f"output differs in {len(differences)} requests, first:", file=file)
+			for index, recorded, replayed in differences[:10]:
+				print(f" {index}: recorded {recorded!r}, replayed {replayed!r}", file=file)
+		else:
+			print("output equivalent", file=file)
+		
+		return not differences
+
+
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	fast = bool(args) and args[0] == '--fast'
+	if fast:
+		del args[0]
+	
+	if len(args) < 2:
+		print(f"Usage: {sys.argv[0]} [--fast] <log> <manager command...>", file=sys.stderr)
+		exit(1)
+	
+	replay = Replay(read_log(args[0]), args[1:], fast=fast)
+	replay.run()
+	if not replay.report():
+		exit(1)
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+
+"""
+Soak test for listener lifecycle. Runs the compositor on the headless backend and connects a client that maps
+and destroys a toplevel window many times. Fails if resident memory or the number of live `Listener` objects grows.
+
+Usage: ./soak.py [cycles]
+"""
+
+
+import os
+import sys
+
+
+def rss():
+	"Resident set size of this process in bytes."
+	with open('/proc/self/statm') as statm:
+		return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def live_listeners():
+	import gc
+	from pywayland.server import Listener
+	gc.collect()
+	return sum(1 for _obj in gc.get_objects() if isinstance(_obj, Listener))
+
+
+def client(cycles:int):
+	"Wayland client: keep one window (taken as the desktop), then map and destroy another window `cycles` times."
+	
+	from pywayland.client import Display
+	from pywayland.protocol.wayland import WlCompositor, WlShm
+	from pywayland.protocol.xdg_shell import XdgWmBase
+	from pywayland.utils import AnonymousFile
+	
+	width, height = 64, 48
+	stride = width * 4
+	
+	display = Display()
+	display.connect()
+	
+	globals_ = {}
+	
+	def registry_global(registry, id_, interface, version):
+		if interface == 'wl_compositor':
+			globals_['compositor'] = registry.bind(id_, WlCompositor, version)
+		elif interface == 'wl_shm':
+			globals_['shm'] = registry.bind(id_, WlShm, version)
+		elif interface == 'xdg_wm_base':
+			globals_['wm_base'] = registry.bind(id_, XdgWmBase, 1)
+	
+	registry = display.get_registry()
+	registry.dispatcher['global'] = registry_global
+	display.roundtrip()
+	
+	compositor, shm, wm_base = globals_['compositor'], globals_['shm'], globals_['wm_base']
+	wm_base.dispatcher['ping'] = lambda wm_base, serial: wm_base.pong(serial)
+	
+	with AnonymousFile(stride * height) as fd:
+		pool = shm.create_pool(fd, stride * height)
+	buffer = pool.create_buffer(0, width, height, stride, WlShm.format.argb8888.value)
+	
+	def map_window():
+		surface = compositor.create_surface()
+		xdg_surface = wm_base.get_xdg_surface(surface)
+		toplevel = xdg_surface.get_toplevel()
+		configured = []
+		
+		def configure(xdg_surface, serial):
+			xdg_surface.ack_configure(serial)
+			configured.append(serial)
+		
+		xdg_surface.dispatcher['configure'] = configure
+		surface.commit()
+		while not configured:
+			display.dispatch(block=True)
+		surface.attach(buffer, 0, 0)
+		surface.commit()
+		display.roundtrip()
+		return surface, xdg_surface, toplevel
+	
+	map_window() # desktop
+	
+	for cycle in range(cycles):
+		surface, xdg_surface, toplevel = map_window()
+		toplevel.destroy()
+		xdg_surface.destroy()
+		surface.destroy()
+		display.roundtrip()
+	
+	display.disconnect()
+
+
+def server(cycles:int, warmup:int=1000, sample:int=1000, rss_tolerance:int=4 * 1024 * 1024) -> bool:
+	"Run the compositor and the client; sample memory and listener count every `sample` destroyed windows."
+	
+	import logging
+	import signal
+	from subprocess import Popen
+	
+	os.environ.setdefault('WLR_BACKENDS', 'headless')
+	os.environ.setdefault('WLR_HEADLESS_OUTPUTS', '1')
+	os.environ.setdefault('WLR_RENDERER', 'pixman')
+	os.environ.setdefault('WLR_LIBINPUT_NO_DEVICES', '1')
+	
+	from compositor import Server
+	
+	logging.getLogger().setLevel(logging.WARNING)
+	samples = []
+	
+	class SoakServer(Server):
+		destroyed = 0
+		
+		def surface_destroy(self, listener, event, surface):
+			Server.surface_destroy(self, listener, event, surface)
+			self.destroyed += 1
+			if self.destroyed >= warmup and self.destroyed % sample == 0:
+				samples.append((self.destroyed, rss(), live_listeners(), len(self.listeners)))
+				print("cycles: {}, rss: {}, listeners: {}, registered: {}".format(*samples[-1]))
+	
+	with SoakServer(log=logging, cursor_size=24, seat_id='seat0') as soak_server:
+		environ = os.environ.copy()
+		environ['WAYLAND_DISPLAY'] = soak_server.socket.decode()
+		child = Popen([sys.executable, __file__, '--client', str(cycles)], env=environ)
+		soak_server.event_loop.add_signal(signal.SIGCHLD, lambda signum, _: soak_server.display.terminate() if child.poll() is not None else None)
+		soak_server.display.run()
+		child.wait()
+	
+	if child.returncode:
+		print(f"client failed: {child.returncode}")
+		return False
+	
+	if len(samples) < 2:
+		print("not enough samples, increase number of cycles")
+		return False
+	
+	_, rss_first, listeners_first, registered_first = samples[0]
+	_, rss_last, listeners_last, registered_last = samples[-1]
+	
+	ok = True
+	if rss_last - rss_first > rss_tolerance:
+		print(f"RSS grew by {rss_last - rss_first} bytes")
+		ok = False
+	if listeners_last > listeners_first or registered_last > registered_first:
+		print(f"live listeners grew from {listeners_first} to {listeners_last} ({registered_first} to {registered_last} registered)")
+		ok = False
+	return ok
+
+
+if __name__ == '__main__':
+	if len(sys.argv) > 2 and sys.argv[1] == '--client':
+		client(int(sys.argv[2]))
+	else:
+		cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+		if not server(cycles):
+			print("soak test failed")
+			exit(1)
+		print("soak test passed")
@@ -0,0 +1,93 @@
+"""
+Tests of `FrameCapture` copying paths, fed with frames from memory instead of a mapped output buffer.
+Run with `python -m pytest test_capture.py`; needs pywlroots, like the compositor.
+"""
+
+
+import logging
+
+import pytest
+
+pytest.importorskip('wlroots')
+
+from capture import FrameCapture
+
+
+WIDTH, HEIGHT = 8, 40
+STRIDE = WIDTH * 4
+FORMAT = 0x34325258 # XRGB8888
+
+
+class Output:
+	"Stand-in for `wlroots.wlr_types.Output`; capture only uses its identity."
+
+
+def frame(value:int) -> bytearray:
+	return bytearray([value]) * (STRIDE * HEIGHT)
+
+
+def capture(frame_capture, output, source, *damage_only):
+	"Request one capture per flag, fulfill them with `source` and return the frames."
+	
+	frames = []
+	for flag in damage_only:
+		frame_capture.request(output, frames.append, flag)
+	frame_capture.fulfill(output, frame_capture.requests.pop(id(output)), source, WIDTH, HEIGHT, STRIDE, FORMAT)
+	return frames
+
+
+def test_full_frame():
+	frame_capture = FrameCapture(logging.getLogger())
+	output = Output()
+	source = frame(7)
+	
+	first, second = capture(frame_capture, output, source, False, False)
+	assert bytes(first.pixels) == bytes(source)
+	assert first.damage == second.damage == [(0, 0, WIDTH, HEIGHT)]
+	assert (first.width, first.height, first.stride, first.format) == (WIDTH, HEIGHT, STRIDE, FORMAT)
+	assert first.buffer is not second.buffer # every full capture owns its buffer
+	
+	buffer = first.buffer
+	first.release()
+	second.release()
+	third, = capture(frame_capture, output, frame(9), False)
+	assert third.buffer is buffer or third.buffer is second.buffer # reused from the pool
+	assert bytes(third.row(HEIGHT - 1)) == bytes([9]) * STRIDE
+	frame_capture.close()
+
+
+def test_damage_only():
+	frame_capture = FrameCapture(logging.getLogger())
+	output = Output()
+	source = frame(0)
+	
+	first, = capture(frame_capture, output, source, True)
+	assert first.damage == [(0, 0, WIDTH, HEIGHT)] # nothing to compare with yet
+	
+	assert capture(frame_capture, output, source, True)[0].damage == []
+	
+	band = FrameCapture.band_height
+	source[band * STRIDE + 5] = 1 # second band
+	source[(band + band // 2) * STRIDE] = 1 # same band
+	first, second, full = capture(frame_capture, output, source, True, True, False)
+	assert first.damage == second.damage == [(0, band, WIDTH, band)] # computed once, given to both
+	assert full.damage == [(0, 0, WIDTH, HEIGHT)]
+	assert bytes(first.pixels) == bytes(source)
+	
+	source[0] = 1
+	source[-1] = 1
+	first.release() # persistent buffer is not returned to the pool
+	damaged, = capture(frame_capture, output, source, True)
+	assert damaged.damage == [(0, 0, WIDTH, band), (0, 2 * band, WIDTH, HEIGHT - 2 * band)]
+	assert bytes(damaged.pixels) == bytes(source)
+	frame_capture.close()
+
+
+def test_output_destroy():
+	frame_capture = FrameCapture(logging.getLogger())
+	output = Output()
+	frames = []
+	frame_capture.request(output, frames.append, True)
+	frame_capture.output_destroy(output)
+	assert frames == [None]
+	frame_capture.close()
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+
+from wlroots import ffi, lib
+from wlroots.wlr_types.buffer import Buffer, BufferDataPtrAccessFlag
+
+from native import renderer_render_formats
+
+
+DRM_FORMAT_XRGB8888 = 0x34325258 # fourcc 'XR24', not declared by pywlroots
+
+
+class WallpaperCache:
+	"""
+	Wallpaper images decoded once and kept as buffers pre-scaled to output sizes, so that the wallpaper is never scaled
+	or uploaded again and an output plugged in at an already seen size reuses the existing buffer.
+	Images are scaled to cover the whole output, cropping the edges that do not fit. At most `limit` variants are kept,
+	least recently used are evicted first; buffers still shown by the scene stay alive until their scene node is destroyed.
+	
+	The buffers are written directly, which works with the pixman renderer, like `FrameCapture`.
+	"""
+	
+	def __init__(self, log, limit:int=4):
+		self.log = log
+		self.limit = limit
+		self.sources = {}
+		self.variants = OrderedDict()
+	
+	def load(self, path:str):
+		"Decode the image if not decoded yet. Raises `GLib.Error` if the file can not be loaded."
+		
+		if path not in self.sources:
+			import gi
+			gi.require_version('GdkPixbuf', '2.0')
+			from gi.repository import GdkPixbuf
+			self.sources[path] = GdkPixbuf.Pixbuf.new_from_file(path).add_alpha(False, 0, 0, 0)
+	
+	def get(self, allocator, renderer, path:str, width:int, height:int) -> Buffer | None:
+		"Buffer with the wallpaper scaled to the provided size in pixels, or None if it could not be created."
+		
+		key = path, width, height
+		try:
+			self.variants.move_to_end(key)
+			return self.variants[key]
+		except KeyError:
+			pass
+		
+		self.load(path)
+		buffer = self.__create(allocator, renderer, self.__scale(self.sources[path], width, height), width, height)
+		if buffer is None:
+			return None
+		
+		self.variants[key] = buffer
+		while len(self.variants) > self.limit:
+			key, evicted = self.variants.popitem(last=False)
+			self.log.debug(f"wallpaper: evict {key}")
+			evicted.drop()
+		return buffer
+	
+	@staticmethod
+	def __scale(source, width:int, height:int):
+		"Scale to cover `width` x `height`, keeping aspect ratio, and crop the center."
+		
+		from gi.repository import GdkPixbuf
+		factor = max(width / source.get_width(), height / source.get_height())
+		scaled = source.scale_simple(max(width, round(source.get_width() * factor)), max(height, round(source.get_height() * factor)), GdkPixbuf.InterpType.BILINEAR)
+		return scaled.new_subpixbuf((scaled.get_width() - width) // 2, (scaled.get_height() - height) // 2, width, height)
+	
+	def __create(self, allocator, renderer, pixbuf, width:int, height:int) -> Buffer | None:
+		formats = renderer_render_formats(renderer)
+		format = lib.wlr_drm_format_set_get(formats, DRM_FORMAT_XRGB8888) if formats != ffi.NULL else ffi.NULL
+		if format == ffi.NULL:
+			self.log.error("wallpaper: renderer can not render XRGB8888")
+			return None
+		
+		ptr = lib.wlr_allocator_create_buffer(allocator._ptr, width, height, format)
+		if ptr == ffi.NULL:
+			self.log.error("wallpaper: could not allocate buffer")
+			return None
+		
+		buffer = Buffer(ptr)
+		try:
+			data, data_format, stride = buffer.begin_data_ptr_access(BufferDataPtrAccessFlag.WRITE)
+		except RuntimeError:
+			self.log.error("wallpaper: buffer can not be mapped, use pixman renderer")
+			buffer.drop()
+			return None
+		
+		try:
+			# RGBA bytes to little endian XRGB, converted a whole row at a time
+			pixels = pixbuf.get_pixels()
+			source_stride = pixbuf.get_rowstride()
+			target = ffi.buffer(data, stride * height)
+			row = bytearray(width * 4)
+			for y in range(height):
+				line = pixels[y * source_stride:y * source_stride + width * 4]
+				row[0::4] = line[2::4]
+				row[1::4] = line[1::4]
+				row[2::4] = line[0::4]
+				row[3::4] = line[3::4]
+				target[y * stride:y * stride + width * 4] = row
+		finally:
+			buffer.end_data_ptr_access()
+		
+		return buffer
+	
+	def close(self):
+		for buffer in self.variants.values():
+			buffer.drop()
+		self.variants.clear()
+		self.sources.clear()